@@ -12,6 +12,7 @@ from dotenv import load_dotenv
 import logging
 import traceback
 from sciengine.agent.utils import save_state_for_reading_agent
+from sciengine.model.registry import warmup
 from langchain_core.messages import BaseMessage
 
 # Load environment variables
@@ -51,6 +52,17 @@ if not os.path.exists(static_dir):
 api_app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 
+# 启动时预热 BioBERT / BGE，避免第一个请求承担模型加载延迟
+@api_app.on_event("startup")
+async def warmup_models():
+    if os.getenv("SKIP_MODEL_WARMUP"):
+        return
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, warmup)
+    except Exception as e:
+        logger.error(f"Model warmup failed: {str(e)}")
+
+
 class QueryInput(BaseModel):
     query: str
 
@@ -5,7 +5,7 @@
 import json
 import os
 from datetime import datetime
-import requests
+from sciengine.tools.http_client import http_get
 
 
 # =====================================================
@@ -119,7 +119,7 @@ def test_api_connectivity():
     }
 
     try:
-        response = requests.get(base_url, params=params)
+        response = http_get(base_url, params=params)
         debug(f"PubMed API status: {response.status_code}")
         return response.status_code == 200
     except Exception as e:
@@ -0,0 +1,47 @@
+# sciengine/model/batching.py
+"""
+按 token 长度分桶的批处理调度器。
+tokenizer 使用 padding=True 时，一个长 passage 会把同批次所有短 passage 都 pad 到它的长度；
+先按长度排序，再把长度相近的输入分到同一个桶，每个桶按自己的最大长度 pad，最后按原顺序还原结果。
+BioBERTEmbeddings 与 BgeReranker 共用。
+"""
+from typing import List, Optional, Sequence
+
+
+def length_buckets(lengths: Sequence[int], batch_size: int,
+                   max_tokens: Optional[int] = None) -> List[List[int]]:
+    """
+    输入:
+        lengths: 每条输入的 token 长度
+        batch_size: 每个桶最多包含的条数
+        max_tokens: 每个桶 pad 后的 token 总数上限（条数 × 桶内最大长度），None 表示不限制；
+                    单条超过上限时单独成桶
+    输出: [[idx, ...], ...]，每个子列表是一个桶（原始下标），桶内长度相近
+    """
+    batch_size = max(1, int(batch_size))
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    buckets: List[List[int]] = []
+    current: List[int] = []
+    for idx in order:
+        # 升序遍历，当前这条就是加入后桶内最长的一条
+        padded = (len(current) + 1) * lengths[idx]
+        if current and (len(current) >= batch_size or (max_tokens and padded > max_tokens)):
+            buckets.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def restore_order(buckets: List[List[int]], bucket_results: List[list]) -> list:
+    """
+    把按桶计算出的结果还原成原始输入顺序
+    """
+    total = sum(len(b) for b in buckets)
+    results = [None] * total
+    for bucket, outputs in zip(buckets, bucket_results):
+        for idx, out in zip(bucket, outputs):
+            results[idx] = out
+    return results
@@ -8,6 +8,8 @@ from langchain.embeddings.base import Embeddings
 import torch
 from transformers import AutoTokenizer, AutoModel
 import os
+from sciengine.model.batching import length_buckets, restore_order
+from sciengine.model.embedding_cache import CacheLockedError, EmbeddingCache, DEFAULT_CACHE_DIR
 
 # ---------------------------------------
 # 本地模型路径
@@ -20,7 +22,10 @@ print("[BioBERT] MODEL PATH =", model_path)
 
 
 class BioBERTEmbeddings(Embeddings):
-    def __init__(self, model_path=model_path):
+    def __init__(self, model_path=model_path, batch_size: int = 32, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        cache_dir: chunk 向量的磁盘缓存目录，传 None 关闭缓存
+        """
 
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"BioBERT 模型不存在: {model_path}")
@@ -40,15 +45,69 @@ class BioBERTEmbeddings(Embeddings):
         self.model.eval()
 
         self.torch = torch
+        # 每次前向传播送入模型的 chunk 数
+        self.batch_size = max(1, int(batch_size))
+
+        # chunk 向量缓存，key = (模型目录名, chunk 文本哈希)
+        self.cache = None
+        if cache_dir:
+            try:
+                self.cache = EmbeddingCache(
+                    model_id=os.path.basename(os.path.normpath(model_path)),
+                    dim=self.model.config.hidden_size,
+                    cache_dir=cache_dir,
+                )
+            except CacheLockedError as e:
+                # 缓存是单进程的，其他进程占用时本进程不使用缓存
+                print(f"[BioBERT] {e}，本进程不使用嵌入缓存")
 
     # ---- langchain 接口实现 ----
     def embed_documents(self, texts):
-        return [self._embed(t) for t in texts]
+        """
+        先查磁盘缓存，只对未命中的 chunk 跑模型，新算出的向量写回缓存，结果顺序与输入一致
+        """
+        texts = list(texts)
+        if self.cache is None:
+            return self._embed_texts(texts)
+
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            computed = self._embed_texts([texts[i] for i in missing])
+            for i, vec in zip(missing, computed):
+                vectors[i] = vec
+            self.cache.put_many([texts[i] for i in missing], computed)
+            self.cache.flush()
+        print(f"[BioBERT] 嵌入 {len(texts)} 个 chunk，缓存命中 {len(texts) - len(missing)}")
+        return vectors
 
     def embed_query(self, text):
         return self._embed(text)
 
+    def embed_queries(self, texts):
+        """
+        多个 query 一次批量编码（不写入 chunk 缓存）
+        """
+        return self._embed_texts(list(texts))
+
     # ---- 嵌入函数 ----
+    def _embed_texts(self, texts):
+        """
+        批量嵌入：先按 token 长度分桶，每桶（最多 batch_size 个 chunk）按桶内最大长度 pad 后
+        做一次前向传播，结果顺序与输入一致
+        """
+        if not texts:
+            return []
+
+        # 只截断不 pad，拿到每条的真实长度
+        encoded = self.tokenizer(texts, truncation=True, padding=False)
+        features = [{k: encoded[k][i] for k in encoded.keys()} for i in range(len(texts))]
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+
+        buckets = length_buckets(lengths, self.batch_size)
+        bucket_vectors = [self._embed_features([features[i] for i in bucket]) for bucket in buckets]
+        return restore_order(buckets, bucket_vectors)
+
     def _embed(self, text):
         inputs = self.tokenizer(
             text,
@@ -63,3 +122,16 @@ class BioBERTEmbeddings(Embeddings):
 
         # 使用 CLS token 向量
         return outputs.last_hidden_state[:, 0, :].squeeze().cpu().numpy().tolist()
+
+    def _embed_features(self, features):
+        """
+        一个桶的已分词输入 → pad 到桶内最大长度 → 一次前向传播，返回 List[List[float]]
+        """
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors="pt")
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+        with self.torch.no_grad():
+            outputs = self.model(**inputs)
+
+        # 使用 CLS token 向量（保持二维，单条输入也不会被 squeeze 掉）
+        return outputs.last_hidden_state[:, 0, :].cpu().numpy().tolist()
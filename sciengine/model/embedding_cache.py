@@ -0,0 +1,231 @@
+# sciengine/model/embedding_cache.py
+"""
+chunk 向量的持久化缓存（内容寻址）。
+key = (模型 id, sha1(chunk 文本))，同一篇 PMC 论文在相关查询中反复出现时，直接复用已算好的向量。
+
+磁盘布局（每个模型一个子目录）：
+    <cache_dir>/<model_id>/vectors.bin   # np.memmap，shape=(capacity, dim)，float16/float32 连续矩阵
+    <cache_dir>/<model_id>/index.npz     # keys(sha1 摘要, uint8[n,20]) / slots(行号) 两个数组，按 LRU 从旧到新排列
+    <cache_dir>/<model_id>/meta.json     # dim / dtype / capacity
+    <cache_dir>/<model_id>/.lock         # 进程独占锁
+超过 max_entries 时按 LRU 淘汰，被淘汰条目的行直接复用；若该行仍被磁盘上的 index.npz 引用，
+先重写索引（去掉被淘汰的 key）再改写该行，中途崩溃也不会让旧 key 读到别的文本的向量。
+缓存是单进程的：LRU 索引与行分配只在进程内维护，多个进程同时写会互相覆盖行。
+打开时对 .lock 加非阻塞的独占 flock，已被其他进程占用时抛 CacheLockedError，调用方应不使用缓存
+（Windows 上没有 fcntl，不加锁）。
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows：不加锁
+    fcntl = None
+
+# 默认缓存目录（与 ./chroma_papers 同级）
+DEFAULT_CACHE_DIR = "./embedding_cache"
+
+# vectors.bin 每次扩容的最小行数
+_GROW_ROWS = 4096
+
+
+class CacheLockedError(RuntimeError):
+    """缓存目录正被其他进程使用"""
+
+
+def text_key(text: str) -> bytes:
+    """chunk 文本 → 20 字节 sha1 摘要"""
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, model_id: str, dim: int, cache_dir: str = DEFAULT_CACHE_DIR,
+                 max_entries: int = 200_000, dtype: str = "float16"):
+        self.model_id = model_id
+        self.dim = int(dim)
+        self.max_entries = max(1, int(max_entries))
+        self.dtype = np.dtype(dtype)
+        self.root = os.path.join(cache_dir, model_id)
+        self._vectors_path = os.path.join(self.root, "vectors.bin")
+        self._index_path = os.path.join(self.root, "index.npz")
+        self._meta_path = os.path.join(self.root, "meta.json")
+
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[bytes, int]" = OrderedDict()  # key -> 行号，最旧在前
+        self._free: List[int] = []
+        self._on_disk: set = set()  # 磁盘上 index.npz 引用的行
+        self._capacity = 0
+        self._matrix = None
+        self._dirty = False
+
+        os.makedirs(self.root, exist_ok=True)
+        self._lock_file = self._acquire_process_lock()
+        self._load()
+
+    # =====================================================================
+    # 读写
+    # =====================================================================
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        命中返回向量，未命中返回 None，顺序与输入一致
+        """
+        results: List[Optional[List[float]]] = []
+        with self._lock:
+            for text in texts:
+                key = text_key(text)
+                slot = self._lru.get(key)
+                if slot is None:
+                    results.append(None)
+                    continue
+                self._lru.move_to_end(key)
+                results.append(self._matrix[slot].astype(np.float32).tolist())
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        with self._lock:
+            # 先分配行，再写向量
+            writes = []
+            fresh = set()
+            reused = False
+            for text, vec in zip(texts, vectors):
+                key = text_key(text)
+                slot = self._lru.get(key)
+                if slot is None:
+                    slot = self._allocate_slot()
+                    fresh.add(key)
+                    reused = reused or slot in self._on_disk
+                self._lru[key] = slot
+                self._lru.move_to_end(key)
+                writes.append((slot, vec))
+            if reused:
+                # 复用的行仍被磁盘索引引用（被淘汰的 key）→ 先写不含这些 key 与本批新 key 的索引
+                self._write_index(exclude=fresh)
+            for slot, vec in writes:
+                self._matrix[slot] = np.asarray(vec, dtype=self.dtype)
+            if writes:
+                self._dirty = True
+
+    def flush(self):
+        """把向量矩阵和 LRU 索引写回磁盘（索引先写临时文件再原子替换）"""
+        with self._lock:
+            if not self._dirty or self._matrix is None:
+                return
+            self._write_index()
+            self._write_meta()
+            self._dirty = False
+
+    def __len__(self):
+        return len(self._lru)
+
+    # =====================================================================
+    # 内部
+    # =====================================================================
+    def _acquire_process_lock(self):
+        lock_file = open(os.path.join(self.root, ".lock"), "a+")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise CacheLockedError(f"嵌入缓存正被其他进程使用: {self.root}")
+        # 进程退出时随文件描述符一起释放
+        return lock_file
+
+    def _write_index(self, exclude=()):
+        """先刷向量矩阵，再原子替换 index.npz；exclude 中的 key（向量尚未写入）不写进索引"""
+        self._matrix.flush()
+        entries = [(k, s) for k, s in self._lru.items() if k not in exclude]
+        # 摘要以 (n, 20) uint8 矩阵保存（"S20" 会吞掉末尾的 \x00）
+        keys = np.frombuffer(b"".join(k for k, _ in entries), dtype=np.uint8).reshape(-1, 20)
+        slots = np.fromiter((s for _, s in entries), dtype=np.int32, count=len(entries))
+        tmp_path = self._index_path + ".tmp.npz"
+        np.savez(tmp_path, keys=keys, slots=slots)
+        os.replace(tmp_path, self._index_path)
+        self._on_disk = set(slots.tolist())
+
+    def _allocate_slot(self) -> int:
+        if len(self._lru) >= self.max_entries:
+            # LRU 淘汰最旧条目，复用其行
+            _, slot = self._lru.popitem(last=False)
+            return slot
+        if not self._free:
+            # 现有行全部占用且未到上限 → 扩容
+            self._grow(min(self.max_entries, max(self._capacity * 2, self._capacity + _GROW_ROWS)))
+        return self._free.pop()
+
+    def _grow(self, capacity: int):
+        """把 vectors.bin 扩到 capacity 行，新增的行进入空闲列表"""
+        old_capacity = self._capacity
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        row_bytes = self.dim * self.dtype.itemsize
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(capacity * row_bytes)
+        self._capacity = capacity
+        self._matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        # 倒序压栈，pop 时从小行号开始用
+        self._free.extend(range(capacity - 1, old_capacity - 1, -1))
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "capacity": self._capacity}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _load(self):
+        meta = None
+        if os.path.exists(self._meta_path):
+            try:
+                with open(self._meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except Exception as e:
+                print(f"[EmbeddingCache] meta.json 损坏，重建缓存: {e}")
+
+        row_bytes = self.dim * self.dtype.itemsize
+        capacity = int(meta.get("capacity", 0)) if meta else 0
+        if meta and (capacity <= 0 or not os.path.exists(self._vectors_path)
+                     or os.path.getsize(self._vectors_path) < capacity * row_bytes):
+            # meta 写入后 vectors.bin 未写完 / 被删除 → 与 meta 不一致
+            print(f"[EmbeddingCache] vectors.bin 缺失或小于 meta.json 记录的 {capacity} 行，重建缓存")
+            meta = None
+
+        if not meta or meta.get("dim") != self.dim or meta.get("dtype") != self.dtype.name:
+            # 不存在 / 损坏 / 维度或精度不匹配 → 清空重建
+            for path in (self._vectors_path, self._index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._grow(min(self.max_entries, _GROW_ROWS))
+            return
+
+        self._capacity = capacity
+        self._matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+",
+                                 shape=(self._capacity, self.dim))
+
+        if os.path.exists(self._index_path):
+            try:
+                with np.load(self._index_path) as index:
+                    for key, slot in zip(index["keys"], index["slots"].tolist()):
+                        self._lru[key.tobytes()] = int(slot)
+            except Exception as e:
+                print(f"[EmbeddingCache] index.npz 损坏，清空索引: {e}")
+                self._lru.clear()
+
+        # 索引只保留容量内的行；超过 max_entries（参数调小）时丢掉最旧的
+        for key in [k for k, s in self._lru.items() if s >= self._capacity]:
+            del self._lru[key]
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+        used = set(self._lru.values())
+        self._on_disk = set(used)
+        self._free = [s for s in range(self._capacity - 1, -1, -1) if s not in used]
+        print(f"[EmbeddingCache] 已加载 {len(self._lru)} 条缓存向量: {self.root}")
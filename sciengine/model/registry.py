@@ -0,0 +1,76 @@
+# sciengine/model/registry.py
+"""
+进程级模型注册表：BioBERTEmbeddings / BgeReranker 每个进程只加载一次。
+- 首次调用时懒加载，之后所有 node / tool 共用同一个实例
+- 加载过程加锁，多线程并发写作时不会重复加载
+- warmup() 供服务启动时预热，避免第一个请求承担加载延迟
+- 微批大小由环境变量配置（未设置时用各模型的默认值）：
+    SCI_BIOBERT_BATCH_SIZE   BioBERT 编码的微批条数
+    SCI_RERANK_BATCH_SIZE    reranker 每个微批的句对数
+    SCI_RERANK_MAX_TOKENS    reranker 每个微批 pad 后的 token 总数
+"""
+import os
+import threading
+from typing import Any, Callable, Dict
+
+_models: Dict[str, Any] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_load(name: str, loader: Callable[[], Any]) -> Any:
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+
+    # 每个模型一把锁：加载 reranker 时不阻塞 embedding 的获取
+    with lock:
+        model = _models.get(name)
+        if model is None:
+            print(f"[Registry] 首次加载模型: {name}")
+            model = loader()
+            _models[name] = model
+    return model
+
+
+def _env_kwargs(**names: str) -> Dict[str, int]:
+    """{参数名: 环境变量名} → 已设置的环境变量组成的构造参数"""
+    return {arg: int(os.environ[env]) for arg, env in names.items() if os.getenv(env)}
+
+
+def _load_embedding():
+    from sciengine.model.bioembedding_model import BioBERTEmbeddings  # 延迟导入
+    return BioBERTEmbeddings(**_env_kwargs(batch_size="SCI_BIOBERT_BATCH_SIZE"))
+
+
+def _load_reranker():
+    from sciengine.tools.bge_reranker import BgeReranker  # 延迟导入
+    return BgeReranker(**_env_kwargs(batch_size="SCI_RERANK_BATCH_SIZE",
+                                     max_tokens="SCI_RERANK_MAX_TOKENS"))
+
+
+def get_embedding_model():
+    """进程内共享的 BioBERTEmbeddings"""
+    return _get_or_load("biobert", _load_embedding)
+
+
+def get_reranker_model():
+    """进程内共享的 BgeReranker（加载失败时抛异常，由调用方决定是否降级）"""
+    return _get_or_load("bge-reranker", _load_reranker)
+
+
+def warmup(embedding: bool = True, reranker: bool = True):
+    """
+    预热：提前加载模型并各跑一次前向传播
+    """
+    if embedding:
+        get_embedding_model().embed_query("warmup")
+    if reranker:
+        try:
+            get_reranker_model().compute_score([("warmup", "warmup")])
+        except Exception as e:
+            print(f"[Registry] reranker 预热失败: {e}")
+    print("[Registry] 模型预热完成")
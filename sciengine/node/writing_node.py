@@ -12,7 +12,7 @@ from typing import Dict, Any
 from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.prebuilt import create_react_agent
 from sciengine.model.llm_models import get_chat_model
-from sciengine.tools.writing_tools import strongest_retrieve
+from sciengine.tools.writing_tools import strongest_retrieve_many
 from sciengine.agent.agent_prompts import QUESTION_SYSTEM_PROMPT, GENERATE_SYSTEM_PROMPT
 import os
 from sciengine.model.bioembedding_model import BioBERTEmbeddings
@@ -63,10 +63,10 @@ def _write_one_section(section: Dict[str, Any], overallstate: Dict[str, Any]) ->
             query = title
             questions = [f"What is known about {title}?"]
 
-        # Step 2: 检索
+        # Step 2: 检索（本节全部问题一起检索、一起精排）
         context = []
-        for q in questions:
-            context.extend(strongest_retrieve(q, overallstate))
+        for docs in strongest_retrieve_many(questions, overallstate):
+            context.extend(docs)
         seen = set()
         context = [d for d in context if d.page_content not in seen and not seen.add(d.page_content)]
 
@@ -0,0 +1,620 @@
+# sciengine/tools/ann_index.py
+"""
+近似最近邻（ANN）向量库后端：IVF-PQ。
+面向跨请求共享、规模到百万级 chunk 的持久化文献库，作为 vector_store 的可选后端（SCI_VECTOR_BACKEND=ivfpq）。
+
+- 粗量化：k-means 得到 nlist 个中心（默认按训练时的数据量取 ≈ sqrt(n)），每个向量归入最近的中心（倒排列表）
+- 训练只用随机抽样的 max(256 × nlist, 100k) 行（train_sample 可调），之后分块编码全部向量，
+  内存与 n × nlist 无关
+- 乘积量化：残差切成 m 段，每段用 256 个码字编码成 1 个字节
+- 查询：只扫描最近的 nprobe 个列表，用查表（ADC）算近似内积，取 refine × k 个候选后
+  再用原始向量（float16）精排
+- 调参：nprobe / refine 越大召回越高、延迟越高；查询时可直接改属性
+- 增量插入：训练完成后新向量直接分配到最近列表并编码；训练前（数据量不足）退化为精确检索
+- 重新训练：build_index 时活跃向量数超过上次训练时的 retrain_factor 倍（默认 4）就重新训练，
+  nlist 随语料增长，倒排列表长度保持在 ≈ sqrt(n)
+- 持久化：向量 / 编码 / 列表号是 mmap 的定长行文件，只追加不改写：覆盖写同一 id 时追加新行并把旧行
+  标记为失效，删除只记失效标记；persist 只追加新增行与失效标记的记录并重写 meta.json，写入成本与库大小无关。
+  训练 / 重新训练 / 失效行多于活跃行时的压缩写出一代新文件（只含活跃行），meta.json 提交后才生效，
+  之后删除旧一代文件；提交前崩溃时磁盘上仍是上一次提交的完整状态
+
+磁盘布局（<path>/ivfpq/，<gen> 为文件代号）：
+    meta.json             # 参数 / 代号 / 是否已训练 / 行数 / 记录文件长度 / 版本号，最后原子写入（提交点）
+    centroids.<gen>.npy   # (nlist, d)，训练后写入
+    codebooks.<gen>.npy   # (m, 256, d/m)，训练后写入
+    vectors.<gen>.f16     # (rows, d) float16 归一化原始向量（精排 / 导出用）
+    codes.<gen>.u8        # (rows, m) uint8
+    assign.<gen>.i32      # (rows,) int32 所属倒排列表
+    records.<gen>.jsonl   # 每个物理行一行 {"id", "document", "metadata"}（提交前已失效的行 id 为 null），
+                          # 以及失效标记 {"delete": 行号}；超过 meta 中 count / records_bytes 的部分视为未提交
+"""
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from sciengine.tools.vector_store import VectorStore, _matches, _metadata_values
+
+ANN_DIRNAME = "ivfpq"
+
+# 每个粗量化中心至少需要的训练样本数
+_MIN_POINTS_PER_CENTROID = 39
+_PQ_CODES = 256
+# 分块计算距离 / 编码的行数
+_BLOCK_ROWS = 65536
+_MIN_TRAIN_SAMPLE = 100_000
+# 按代号命名的数据文件：<name>.<gen>.<ext>
+_GEN_FILE_RE = re.compile(r"^(centroids|codebooks|vectors|codes|assign|records)\.(\d+)\.")
+
+
+class _RowFile:
+    """
+    定长行的二进制文件（无文件头），以 mmap 读写。
+    追加时按 2 倍扩容文件后重新 mmap，不复制已有行；有效行数 rows 以 meta.json 为准，
+    文件中超出 rows 的部分（崩溃前未提交的追加）会在下次追加时被覆盖
+    """
+
+    def __init__(self, path: str, dtype, width: int, rows: int = 0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.row_bytes = self.dtype.itemsize * width
+        self.capacity = os.path.getsize(path) // self.row_bytes if os.path.exists(path) else 0
+        if self.capacity < rows:
+            raise ValueError(f"{path} 只有 {self.capacity} 行，少于 meta.json 记录的 {rows} 行")
+        self.rows = rows
+        self._mm = None
+        self._map()
+
+    def _map(self):
+        self._mm = (np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(self.capacity, self.width))
+                    if self.capacity else None)
+
+    def reserve(self, rows: int):
+        if rows <= self.capacity:
+            return
+        capacity = max(rows, self.capacity * 2, 1024)
+        self.flush()
+        with open(self.path, "ab") as f:
+            f.truncate(capacity * self.row_bytes)
+        self.capacity = capacity
+        self._map()
+
+    def resize(self, rows: int):
+        self.reserve(rows)
+        self.rows = rows
+
+    def append(self, data: np.ndarray):
+        data = np.asarray(data, dtype=self.dtype).reshape(-1, self.width)
+        self.reserve(self.rows + len(data))
+        self._mm[self.rows:self.rows + len(data)] = data
+        self.rows += len(data)
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._mm is None:
+            return np.zeros((0, self.width), dtype=self.dtype)
+        return self._mm[:self.rows]
+
+    def flush(self):
+        if self._mm is not None:
+            self._mm.flush()
+
+
+class _RowsView:
+    """
+    行文件中部分行（活跃行）的只读视图，形状 (len(rows), d)；
+    view[idx] 只读取选中的行，不把整个矩阵读进内存
+    """
+
+    def __init__(self, base: np.ndarray, rows: np.ndarray):
+        self.base = base
+        self.rows = rows
+
+    @property
+    def shape(self):
+        return (len(self.rows),) + self.base.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        return self.base[self.rows[idx]]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = np.asarray(self.base[self.rows])
+        return arr if dtype is None else arr.astype(dtype)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def _nearest(data: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """每行最近中心（欧氏距离）的下标，分块计算，距离矩阵最多 _BLOCK_ROWS × len(centers)"""
+    centers_sq = (centers ** 2).sum(1)
+    out = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), _BLOCK_ROWS):
+        block = data[start:start + _BLOCK_ROWS]
+        # ‖x‖² 对 argmin 无影响，省略
+        out[start:start + len(block)] = (centers_sq[None, :] - 2 * block @ centers.T).argmin(1)
+    return out
+
+
+def kmeans(data: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    """朴素 Lloyd k-means（欧氏距离），返回 (n_clusters, d) 中心"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(data))
+    centers = data[rng.choice(len(data), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(n_iter):
+        assign = _nearest(data, centers)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, assign, data)
+        empty = counts == 0
+        centers[~empty] = sums[~empty] / counts[~empty, None]
+        # 空簇随机重新取点
+        if empty.any():
+            centers[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centers
+
+
+
+
+class IVFPQVectorStore(VectorStore):
+    backend = "ivfpq"
+
+    def __init__(self, path: str, embedding=None, nlist: Optional[int] = None, m: int = 16,
+                 nprobe: Optional[int] = None, refine: Optional[int] = None, min_train_size: int = 4096,
+                 train_sample: Optional[int] = None, retrain_factor: float = 4.0):
+        """
+        nlist: 粗量化中心数；未指定时每次训练取 ≈ sqrt(活跃向量数)（训练样本不足时自动下调）
+        m: PQ 分段数（需整除向量维度）
+        nprobe: 每次查询扫描的倒排列表数（未指定时取 SCI_ANN_NPROBE，默认 16）
+        refine: ADC 先取 refine × k 个候选，再用原始向量精排（未指定时取 SCI_ANN_REFINE，默认 4）
+        min_train_size: 累计向量数达到该值时才训练，之前走精确检索
+        train_sample: 训练用的抽样行数，默认 max(256 × nlist, 100000)
+        retrain_factor: 活跃向量数达到上次训练时的该倍数时，build_index 重新训练
+        """
+        super().__init__(path)
+        self.root = os.path.join(path, ANN_DIRNAME)
+        self.nlist = nlist
+        self.m = m
+        # 显式参数优先，环境变量只作默认值
+        self.nprobe = int(nprobe if nprobe is not None else os.getenv("SCI_ANN_NPROBE", 16))
+        self.refine = int(refine if refine is not None else os.getenv("SCI_ANN_REFINE", 4))
+        self.min_train_size = min_train_size
+        self.train_sample = train_sample
+        self.retrain_factor = retrain_factor
+        self._lock = threading.RLock()
+
+        self.version = 0
+        self.trained = False
+        self.trained_size = 0
+        self._gen = 0
+        # 按物理行存放，失效行的 id / document / metadata 为 None
+        self._row_ids: List[Optional[str]] = []
+        self._row_docs: List[Optional[str]] = []
+        self._row_metas: List[Optional[Dict[str, Any]]] = []
+        self._row_of: Dict[str, int] = {}  # id -> 当前物理行
+        self._dead = set()
+        self._live = None  # 活跃物理行号（升序）
+        self.centroids = None
+        self.codebooks = None
+        self._vectors: Optional[_RowFile] = None
+        self._codes: Optional[_RowFile] = None
+        self._assign: Optional[_RowFile] = None
+        self._lists = None  # (order, offsets)，按列表排好的活跃行号
+        self._committed_rows = 0  # 已写入 records 并提交的物理行数
+        self._pending_deletes: List[int] = []  # 已提交、之后失效的行
+        self._records_bytes = 0
+        self._model_dirty = False
+        self._dirty = False
+        self._load()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, ANN_DIRNAME, "meta.json"))
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _gen_file(self, name: str, gen: Optional[int] = None) -> str:
+        stem, ext = name.split(".", 1)
+        return self._file(f"{stem}.{self._gen if gen is None else gen}.{ext}")
+
+    def _open_rows(self, dim: int, rows: int, coded_rows: int, gen: Optional[int] = None):
+        os.makedirs(self.root, exist_ok=True)
+        self._vectors = _RowFile(self._gen_file("vectors.f16", gen), np.float16, dim, rows)
+        self._codes = _RowFile(self._gen_file("codes.u8", gen), np.uint8, self.m, coded_rows)
+        self._assign = _RowFile(self._gen_file("assign.i32", gen), np.int32, 1, coded_rows)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors.array if self._vectors else np.zeros((0, 0), dtype=np.float16)
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes.array if self._codes else np.zeros((0, self.m), dtype=np.uint8)
+
+    @property
+    def assign(self) -> np.ndarray:
+        return self._assign.array[:, 0] if self._assign else np.zeros(0, dtype=np.int32)
+
+    def _live_rows(self) -> np.ndarray:
+        if self._live is None:
+            mask = np.ones(len(self._row_ids), dtype=bool)
+            if self._dead:
+                mask[np.fromiter(self._dead, dtype=np.int64, count=len(self._dead))] = False
+            self._live = np.flatnonzero(mask)
+        return self._live
+
+    def _live_vectors(self):
+        """活跃行的 (n, d) 向量：没有失效行时直接是 mmap 视图"""
+        if not self._dead:
+            return self.vectors
+        return _RowsView(self.vectors, self._live_rows())
+
+    def _kill(self, row: int):
+        """把物理行标记为失效（覆盖写 / 删除）；已提交的行在 persist 时追加失效标记"""
+        self._dead.add(row)
+        self._row_ids[row] = self._row_docs[row] = self._row_metas[row] = None
+        if row < self._committed_rows:
+            self._pending_deletes.append(row)
+        self._live = None
+        self._lists = None
+
+    # =====================================================================
+    # 训练 / 编码
+    # =====================================================================
+    def train(self, seed: int = 0):
+        """在抽样的活跃向量上训练粗量化中心与 PQ 码本，写出只含活跃行的新一代文件并分块编码"""
+        with self._lock:
+            self._rebuild(train=True, seed=seed)
+
+    def _rebuild(self, train: bool, seed: int = 0):
+        """
+        写一代新的行文件，只保留活跃行（行号按原顺序重排）；train=True 时重新训练并编码，否则沿用原编码。
+        新一代文件在 persist 写 meta.json 之前不生效
+        """
+        live = self._live_rows()
+        n = len(live)
+        dim = self._vectors.width if self._vectors else 0
+        if train and n == 0:
+            raise ValueError("向量库为空，无法训练 IVF-PQ 索引")
+        if train and dim % self.m:
+            raise ValueError(f"PQ 分段数 m={self.m} 不能整除向量维度 {dim}")
+
+        gen = self._gen + 1
+        for name in ("vectors.f16", "codes.u8", "assign.i32"):
+            # 上次未提交的同代文件
+            if os.path.exists(self._gen_file(name, gen)):
+                os.remove(self._gen_file(name, gen))
+        old_vectors, old_codes, old_assign = self.vectors, self.codes, self.assign
+        self._open_rows(dim, 0, 0, gen)
+        for start in range(0, n, _BLOCK_ROWS):
+            self._vectors.append(old_vectors[live[start:start + _BLOCK_ROWS]])
+
+        if train:
+            self._train_model(seed)
+            for start in range(0, n, _BLOCK_ROWS):
+                block = np.asarray(self.vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+                assign = self._coarse_assign(block)
+                self._assign.append(assign[:, None])
+                self._codes.append(self._encode(block - self.centroids[assign]))
+            self.trained = True
+            self.trained_size = n
+        elif self.trained:
+            for start in range(0, n, _BLOCK_ROWS):
+                rows = live[start:start + _BLOCK_ROWS]
+                self._codes.append(old_codes[rows])
+                self._assign.append(old_assign[rows][:, None])
+
+        self._row_ids = [self._row_ids[r] for r in live]
+        self._row_docs = [self._row_docs[r] for r in live]
+        self._row_metas = [self._row_metas[r] for r in live]
+        self._row_of = {cid: row for row, cid in enumerate(self._row_ids)}
+        self._dead.clear()
+        self._live = None
+        self._lists = None
+        self._gen = gen
+        # 新一代记录文件从头写
+        self._committed_rows = 0
+        self._pending_deletes = []
+        self._records_bytes = 0
+        self._model_dirty = self.trained
+        self._dirty = True
+        self.version += 1
+
+    def _train_model(self, seed: int):
+        """在新一代向量文件的随机抽样上训练中心与码本"""
+        n, dim = self.vectors.shape
+        target = self.nlist or max(1, int(round(np.sqrt(n))))
+        sample = self.train_sample or max(_PQ_CODES * target, _MIN_TRAIN_SAMPLE)
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(n, sample, replace=False)) if n > sample else np.arange(n)
+        data = np.asarray(self.vectors[rows], dtype=np.float32)
+        nlist = max(1, min(target, len(data) // _MIN_POINTS_PER_CENTROID))
+        print(f"[IVFPQ] 训练: n={n}, 抽样 {len(data)}, nlist={nlist}, m={self.m}")
+
+        self.centroids = _normalize(kmeans(data, nlist, seed=seed))
+        residuals = data - self.centroids[self._coarse_assign(data)]
+        dsub = dim // self.m
+        self.codebooks = np.stack([
+            kmeans(residuals[:, j * dsub:(j + 1) * dsub], _PQ_CODES, n_iter=15, seed=j)
+            if len(data) >= _PQ_CODES else
+            np.pad(residuals[:, j * dsub:(j + 1) * dsub], ((0, _PQ_CODES - len(data)), (0, 0)))
+            for j in range(self.m)
+        ]).astype(np.float32)
+
+    def _coarse_assign(self, data: np.ndarray) -> np.ndarray:
+        """归一化向量与中心的内积最大者（分块计算）"""
+        out = np.empty(len(data), dtype=np.int32)
+        for start in range(0, len(data), _BLOCK_ROWS):
+            block = data[start:start + _BLOCK_ROWS]
+            out[start:start + len(block)] = (block @ self.centroids.T).argmax(1)
+        return out
+
+    def _encode(self, residuals: np.ndarray) -> np.ndarray:
+        dsub = residuals.shape[1] // self.m
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = residuals[:, j * dsub:(j + 1) * dsub]
+            book = self.codebooks[j]
+            dist = (sub ** 2).sum(1)[:, None] - 2 * sub @ book.T + (book ** 2).sum(1)[None, :]
+            codes[:, j] = dist.argmin(1)
+        return codes
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            live = self._live_rows()
+            assign = np.asarray(self.assign)[live]
+            order = live[np.argsort(assign, kind="stable")]
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(self.centroids)))])
+            self._lists = (order, offsets)
+        return self._lists
+
+    # =====================================================================
+    # VectorStore 接口
+    # =====================================================================
+    def add(self, ids, texts, metadatas, embeddings):
+        if not ids:
+            return
+        vecs = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            if self._vectors is None:
+                self._open_rows(vecs.shape[1], 0, 0)
+            for cid, text, meta in zip(ids, texts, metadatas):
+                old = self._row_of.get(cid)
+                if old is not None:
+                    # 覆盖写：旧行失效，新内容追加为新行（已提交的行不原地修改）
+                    self._kill(old)
+                self._row_of[cid] = len(self._row_ids)
+                self._row_ids.append(cid)
+                self._row_docs.append(text)
+                self._row_metas.append(dict(meta or {}))
+            self._vectors.append(vecs)
+            if self.trained:
+                # 增量插入：直接分配到最近的倒排列表并编码
+                assign = self._coarse_assign(vecs)
+                self._assign.append(assign[:, None])
+                self._codes.append(self._encode(vecs - self.centroids[assign]))
+            self._live = None
+            self._lists = None
+            self.version += 1
+            self._dirty = True
+
+    def delete(self, where):
+        with self._lock:
+            rows = [int(r) for r in self._live_rows() if _matches(self._row_metas[r], where)]
+            removed = [self._row_ids[r] for r in rows]
+            for row, cid in zip(rows, removed):
+                del self._row_of[cid]
+                self._kill(row)
+            if rows:
+                self.version += 1
+                self._dirty = True
+            return removed
+
+    def build_index(self):
+        """
+        数据量足够且尚未训练时训练；活跃向量数达到上次训练时的 retrain_factor 倍时重新训练；
+        否则失效行多于活跃行时压缩行文件
+        """
+        with self._lock:
+            n = self.count()
+            if not self.trained:
+                if n and n >= self.min_train_size:
+                    self.train()
+            elif n >= self.retrain_factor * max(self.trained_size, 1):
+                print(f"[IVFPQ] 活跃向量 {n} 已达上次训练时 {self.trained_size} 的 {self.retrain_factor} 倍，重新训练")
+                self.train()
+            elif len(self._dead) > n:
+                self._rebuild(train=False)
+
+    def get_all(self):
+        with self._lock:
+            corpus = self.get_documents()
+            corpus["embeddings"] = np.asarray(self._live_vectors(), dtype=np.float32)
+            return corpus
+
+    def get_documents(self):
+        with self._lock:
+            live = self._live_rows()
+            return {
+                "ids": [self._row_ids[r] for r in live],
+                "documents": [self._row_docs[r] for r in live],
+                "metadatas": [self._row_metas[r] for r in live],
+            }
+
+    def snapshot(self):
+        # float16 mmap 视图（有失效行时为活跃行视图），按行取用时才读盘；已写入的行不会被改写
+        with self._lock:
+            corpus = self.get_documents()
+            corpus["embeddings"] = self._live_vectors()
+            return corpus
+
+    def query(self, query_embeddings, k):
+        q = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock:
+            k = min(int(k), self.count())
+            if k <= 0:
+                return [[] for _ in q]
+            if not self.trained:
+                return self._exact(q, k)
+            return [self._search_one(vec, k) for vec in q]
+
+    def _exact(self, q: np.ndarray, k: int) -> List[List[str]]:
+        live = self._live_rows()
+        scores = q @ np.asarray(self._live_vectors(), dtype=np.float32).T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        return [[self._row_ids[live[r]] for r in row] for row in np.take_along_axis(top, order, axis=1).tolist()]
+
+    def _search_one(self, q: np.ndarray, k: int) -> List[str]:
+        order, offsets = self._inverted_lists()
+        coarse = self.centroids @ q
+        nprobe = min(self.nprobe, len(coarse))
+        probes = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+        cands = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes])
+        if len(cands) == 0:
+            return []
+
+        # ADC：内积 = q·中心 + Σ_j 查表(q 第 j 段 · 码字)
+        dsub = len(q) // self.m
+        lut = np.einsum("jd,jkd->jk", q.reshape(self.m, dsub), self.codebooks)  # (m, 256)
+        codes = np.asarray(self.codes)[cands]
+        approx = coarse[np.asarray(self.assign)[cands]] + lut[np.arange(self.m), codes].sum(1)
+
+        # 取 refine × k 个候选，用原始向量精排
+        shortlist = min(len(cands), max(k, k * self.refine))
+        top = np.argpartition(-approx, shortlist - 1)[:shortlist]
+        rows = cands[top]
+        exact = np.asarray(self.vectors[rows], dtype=np.float32) @ q
+        best = np.argsort(-exact)[:k]
+        return [self._row_ids[r] for r in rows[best]]
+
+    def count(self):
+        return len(self._row_of)
+
+    def metadata_values(self, key, where=None):
+        with self._lock:
+            return _metadata_values([m for m in self._row_metas if m is not None], key, where)
+
+    def fingerprint(self):
+        return (self.count(), self.version)
+
+    def persist(self):
+        """
+        mmap 刷盘，追加新增行与失效标记的记录，最后原子地重写 meta.json（提交点），再删除旧一代文件。
+        已提交的行从不原地修改，提交前崩溃时重新打开得到的是上一次提交的状态
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            for rows in (self._vectors, self._codes, self._assign):
+                if rows is not None:
+                    rows.flush()
+            if self._model_dirty:
+                # 新一代文件，提交前不会被读取
+                np.save(self._gen_file("centroids.npy"), self.centroids)
+                np.save(self._gen_file("codebooks.npy"), self.codebooks)
+                self._model_dirty = False
+            self._write_records()
+            dim = self._vectors.width if self._vectors else 0
+            tmp = self._file("meta.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"gen": self._gen, "dim": dim, "nlist": self.nlist, "m": self.m,
+                           "trained": self.trained, "trained_size": self.trained_size,
+                           "count": len(self._row_ids), "records_bytes": self._records_bytes,
+                           "version": self.version}, f)
+            os.replace(tmp, self._file("meta.json"))
+            self._committed_rows = len(self._row_ids)
+            self._pending_deletes = []
+            self._dirty = False
+            self._remove_old_generations()
+
+    def _write_records(self):
+        lines = [
+            json.dumps({"id": self._row_ids[r], "document": self._row_docs[r], "metadata": self._row_metas[r]},
+                       ensure_ascii=False)
+            for r in range(self._committed_rows, len(self._row_ids))
+        ]
+        lines.extend(json.dumps({"delete": r}) for r in self._pending_deletes)
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+        with open(self._gen_file("records.jsonl"), "a+b") as f:
+            # 丢弃上次未提交（meta 未更新）的尾部
+            f.truncate(self._records_bytes)
+            f.write(data)
+        self._records_bytes += len(data)
+
+    def _remove_old_generations(self):
+        for name in os.listdir(self.root):
+            match = _GEN_FILE_RE.match(name)
+            if match and int(match.group(2)) != self._gen:
+                try:
+                    os.remove(self._file(name))
+                except OSError:
+                    pass
+
+    def _load(self):
+        if not self.exists(self.path):
+            return
+        with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self._gen = meta.get("gen", 0)
+        self.version = meta.get("version", 0)
+        self.m = meta.get("m", self.m)
+        self.nlist = meta.get("nlist", self.nlist)
+        self.trained = meta.get("trained", False)
+        self.trained_size = meta.get("trained_size", 0)
+        count = meta.get("count", 0)
+        self._records_bytes = meta.get("records_bytes", 0)
+
+        with open(self._gen_file("records.jsonl"), "rb") as f:
+            raw = f.read(self._records_bytes)
+        for line in raw.decode("utf-8").splitlines():
+            record = json.loads(line)
+            if "delete" in record:
+                self._kill(record["delete"])
+                continue
+            row = len(self._row_ids)
+            cid = record["id"]
+            self._row_ids.append(cid)
+            self._row_docs.append(record["document"])
+            self._row_metas.append(record["metadata"])
+            if cid is None:
+                self._kill(row)
+                continue
+            old = self._row_of.get(cid)
+            if old is not None:
+                self._kill(old)
+            self._row_of[cid] = row
+        if len(self._row_ids) != count:
+            raise ValueError(f"{self.root} 记录行数 {len(self._row_ids)} 与 meta.json 的 {count} 不一致")
+        self._committed_rows = count
+
+        if meta.get("dim"):
+            self._open_rows(meta["dim"], count, count if self.trained else 0)
+        if self.trained:
+            self.centroids = np.load(self._gen_file("centroids.npy"))
+            self.codebooks = np.load(self._gen_file("codebooks.npy"))
+
+    def is_stale(self):
+        if self._dirty:
+            return False
+        if not self.exists(self.path):
+            return bool(self._row_of)
+        try:
+            with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("version", 0) != self.version
+        except Exception:
+            return True
@@ -8,6 +8,7 @@ BgeReranker 是一个基于 BGE ReRanker（bge-reranker-large） 的句对重排
 import os
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from sciengine.model.batching import length_buckets, restore_order
 
 # 强制离线
 os.environ["HF_HUB_OFFLINE"] = "1"
@@ -22,9 +23,18 @@ model_path = os.path.abspath(model_path)
 
 print("[Reranker] MODEL PATH =", model_path)
 
+# 默认每个微批最多包含的句对数 / pad 后的 token 总数
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_MAX_TOKENS = 8192
+
 
 class BgeReranker:
-    def __init__(self, model_path=model_path):
+    def __init__(self, model_path=model_path, batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_tokens: int = DEFAULT_MAX_TOKENS):
+        """
+        batch_size: 每个微批最多包含的句对数
+        max_tokens: 每个微批 pad 后的 token 总数上限，控制峰值内存与候选数无关
+        """
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"本地 bge-reranker-large 不存在: {model_path}")
 
@@ -43,25 +53,43 @@ class BgeReranker:
         self.model.to(self.device)
         self.model.eval()
 
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+
         print("[Reranker] 加载完成！")
 
-    def compute_score(self, sentence_pairs):
+    def compute_score(self, sentence_pairs, batch_size=None, max_tokens=None):
         """
         输入: [("query", "passage"), ...]
         输出: [score1, score2, ...]
+        按 token 长度排序后切成微批（条数 ≤ batch_size 且 pad 后 token 数 ≤ max_tokens），
+        每批只 pad 到批内最大长度，输出顺序与输入一致
         """
         texts = [f"{q} [SEP] {p}" for q, p in sentence_pairs]
+        if not texts:
+            return []
+
+        # 只截断不 pad，拿到每条的真实长度
+        encoded = self.tokenizer(texts, truncation=True, padding=False, max_length=512)
+        features = [{k: encoded[k][i] for k in encoded.keys()} for i in range(len(texts))]
+        lengths = [len(ids) for ids in encoded["input_ids"]]
 
-        inputs = self.tokenizer(
-            texts,
-            padding=True,
-            truncation=True,
-            return_tensors='pt',
-            max_length=512
-        ).to(self.device)
+        buckets = length_buckets(
+            lengths,
+            batch_size or self.batch_size,
+            max_tokens=max_tokens or self.max_tokens,
+        )
+        bucket_scores = [self._score_features([features[i] for i in bucket]) for bucket in buckets]
+        return restore_order(buckets, bucket_scores)
+
+    def _score_features(self, features):
+        """
+        一个桶的已分词句对 → pad 到桶内最大长度 → 一次前向传播
+        """
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors='pt').to(self.device)
 
         with torch.no_grad():
             outputs = self.model(**inputs)
             scores = outputs.logits.view(-1).float()
 
-        return scores.cpu().numpy().tolist()
\ No newline at end of file
+        return scores.cpu().numpy().tolist()
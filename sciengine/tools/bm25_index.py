@@ -0,0 +1,315 @@
+# sciengine/tools/bm25_index.py
+"""
+持久化、可增量更新的 BM25 索引，存放在 Chroma 持久化目录下（<chroma_dir>/bm25/）。
+create_VDB_par 写入新 chunk 时同步 add，检索时按需以 mmap 方式懒加载，不再每次从全量文档重建。
+
+磁盘布局（倒排表为按词项排列的 CSR 紧凑数组）：
+    vocab.json     # {term: term_id}
+    doc_ids.json   # 行号 → chunk id
+    doc_len.npy    # int32 (n_docs,)  每个文档的词数
+    live.npy       # bool  (n_docs,)  删除采用墓碑标记，死文档过多时压缩
+    indptr.npy     # int64 (n_terms + 1,)
+    post_docs.npy  # int32 (nnz,)  倒排表：文档行号
+    post_tf.npy    # int32 (nnz,)  倒排表：词频
+    meta.json      # 文档数 / 版本号
+打分由 BM25Engine 完成：倒排表直接视为 CSR 词项-文档矩阵，预先乘好 IDF 与长度归一化权重，
+一批 query 只需一次稀疏矩阵乘法，再用 argpartition 取 top-k。
+"""
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+BM25_DIRNAME = "bm25"
+
+# 死文档占比超过该值时压缩倒排表
+_COMPACT_RATIO = 0.3
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Engine:
+    """
+    BM25 稀疏矩阵打分引擎：
+        weights[t, d] = idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+    构建一次（CSR，形状 n_terms × n_docs），之后 scores = Q @ weights，Q 为 query 的词频矩阵
+    """
+
+    def __init__(self, vocab: Dict[str, int], indptr: np.ndarray, post_docs: np.ndarray,
+                 post_tf: np.ndarray, doc_len: np.ndarray, live: np.ndarray,
+                 k1: float = 1.5, b: float = 0.75):
+        self.vocab = vocab
+        n_terms = len(indptr) - 1
+        n_docs = len(doc_len)
+        live = np.asarray(live, dtype=bool)
+        post_docs = np.asarray(post_docs)
+        tf = np.asarray(post_tf, dtype=np.float32)
+        doc_len = np.asarray(doc_len, dtype=np.float32)
+
+        n_live = int(live.sum())
+        avgdl = max(float(doc_len[live].mean()), 1e-6) if n_live else 1.0
+
+        # df 只统计存活文档
+        alive = live[post_docs].astype(np.float32)
+        term_of_posting = np.repeat(np.arange(n_terms), np.diff(indptr))
+        df = np.bincount(term_of_posting, weights=alive, minlength=n_terms)
+        idf = np.log((n_live - df + 0.5) / (df + 0.5) + 1.0).astype(np.float32)
+
+        norm = k1 * (1 - b + b * doc_len / avgdl)
+        weights = idf[term_of_posting] * tf * (k1 + 1) / (tf + norm[post_docs]) * alive
+
+        self.matrix = sp.csr_matrix(
+            (weights.astype(np.float32), post_docs, np.asarray(indptr)),
+            shape=(n_terms, n_docs),
+        )
+        self.live = live
+
+    def query_matrix(self, queries: Sequence[str]) -> sp.csr_matrix:
+        """query → 词频稀疏矩阵（n_queries × n_terms），词表外的词直接丢弃"""
+        data, cols, indptr = [], [], [0]
+        for query in queries:
+            for term, qtf in Counter(tokenize(query)).items():
+                tid = self.vocab.get(term)
+                if tid is not None and tid < self.matrix.shape[0]:
+                    cols.append(tid)
+                    data.append(qtf)
+            indptr.append(len(cols))
+        return sp.csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(cols, dtype=np.int64), np.asarray(indptr)),
+            shape=(len(queries), self.matrix.shape[0]),
+        )
+
+    def top_k(self, queries: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        一次稀疏矩阵乘法为整批 query 打分
+        返回 (rows, scores)，形状均为 (n_queries, k)，每行按分数降序
+        """
+        n_docs = self.matrix.shape[1]
+        k = min(int(k), n_docs)
+        if not queries or k <= 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0), dtype=np.float32)
+
+        scores = (self.query_matrix(queries) @ self.matrix).toarray()
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class BM25Index:
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._engine: Optional[BM25Engine] = None
+        self.version = 0
+
+    @classmethod
+    def for_chroma_dir(cls, chroma_dir: str, **kwargs) -> "BM25Index":
+        return cls(os.path.join(chroma_dir, BM25_DIRNAME), **kwargs)
+
+    # =====================================================================
+    # 加载 / 保存
+    # =====================================================================
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file("meta.json"))
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if self.exists():
+                with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                    self.version = json.load(f).get("version", 0)
+                with open(self._file("vocab.json"), "r", encoding="utf-8") as f:
+                    self.vocab: Dict[str, int] = json.load(f)
+                with open(self._file("doc_ids.json"), "r", encoding="utf-8") as f:
+                    self.doc_ids: List[str] = json.load(f)
+                # 只读 mmap，写操作时再复制到内存
+                self.doc_len = np.load(self._file("doc_len.npy"), mmap_mode="r")
+                self.live = np.load(self._file("live.npy"), mmap_mode="r")
+                self.indptr = np.load(self._file("indptr.npy"), mmap_mode="r")
+                self.post_docs = np.load(self._file("post_docs.npy"), mmap_mode="r")
+                self.post_tf = np.load(self._file("post_tf.npy"), mmap_mode="r")
+            else:
+                self.vocab = {}
+                self.doc_ids = []
+                self.doc_len = np.zeros(0, dtype=np.int32)
+                self.live = np.zeros(0, dtype=bool)
+                self.indptr = np.zeros(1, dtype=np.int64)
+                self.post_docs = np.zeros(0, dtype=np.int32)
+                self.post_tf = np.zeros(0, dtype=np.int32)
+            self._row_of = {cid: row for row, cid in enumerate(self.doc_ids) if self.live[row]}
+            self._loaded = True
+
+    def save(self):
+        with self._lock:
+            self._ensure_loaded()
+            os.makedirs(self.path, exist_ok=True)
+            self.version += 1
+            arrays = {
+                "doc_len.npy": self.doc_len,
+                "live.npy": self.live,
+                "indptr.npy": self.indptr,
+                "post_docs.npy": self.post_docs,
+                "post_tf.npy": self.post_tf,
+            }
+            for name, arr in arrays.items():
+                tmp = self._file(name + ".tmp.npy")
+                np.save(tmp, np.asarray(arr))
+                os.replace(tmp, self._file(name))
+            for name, obj in (("vocab.json", self.vocab), ("doc_ids.json", self.doc_ids)):
+                tmp = self._file(name + ".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(obj, f, ensure_ascii=False)
+                os.replace(tmp, self._file(name))
+            # meta 最后写（原子替换），作为本次保存完成的标记
+            tmp = self._file("meta.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"n_docs": len(self.doc_ids), "n_live": len(self._row_of),
+                           "version": self.version}, f)
+            os.replace(tmp, self._file("meta.json"))
+
+    # =====================================================================
+    # 增量更新
+    # =====================================================================
+    def add(self, ids: Sequence[str], texts: Sequence[str]):
+        """
+        追加文档：只对新文档分词，再与已有倒排表合并；已存在的 id 视为更新（旧行打墓碑）
+        """
+        if not ids:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            existing = [cid for cid in ids if cid in self._row_of]
+            if existing:
+                self.delete(existing, compact=False)
+
+            base = len(self.doc_ids)
+            term_ids, rows, tfs, lengths = [], [], [], []
+            for offset, text in enumerate(texts):
+                tokens = tokenize(text)
+                lengths.append(len(tokens))
+                for term, tf in Counter(tokens).items():
+                    tid = self.vocab.get(term)
+                    if tid is None:
+                        tid = len(self.vocab)
+                        self.vocab[term] = tid
+                    term_ids.append(tid)
+                    rows.append(base + offset)
+                    tfs.append(tf)
+
+            # 旧倒排表展开成 COO，与新文档合并后按词项重新排成 CSR
+            old_terms = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+            all_terms = np.concatenate([old_terms, np.asarray(term_ids, dtype=np.int64)])
+            all_docs = np.concatenate([np.asarray(self.post_docs), np.asarray(rows, dtype=np.int32)])
+            all_tf = np.concatenate([np.asarray(self.post_tf), np.asarray(tfs, dtype=np.int32)])
+            order = np.argsort(all_terms, kind="stable")
+
+            self.post_docs = all_docs[order]
+            self.post_tf = all_tf[order]
+            counts = np.bincount(all_terms, minlength=len(self.vocab))
+            self.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            self.doc_len = np.concatenate([np.asarray(self.doc_len), np.asarray(lengths, dtype=np.int32)])
+            self.live = np.concatenate([np.asarray(self.live), np.ones(len(ids), dtype=bool)])
+            for offset, cid in enumerate(ids):
+                self.doc_ids.append(cid)
+                self._row_of[cid] = base + offset
+            self._engine = None
+
+    def delete(self, ids: Sequence[str], compact: bool = True):
+        """删除文档：打墓碑，死文档过多时压缩"""
+        with self._lock:
+            self._ensure_loaded()
+            rows = [self._row_of.pop(cid) for cid in ids if cid in self._row_of]
+            if not rows:
+                return
+            self.live = np.array(self.live)
+            self.live[rows] = False
+            self._engine = None
+            if compact and len(self.doc_ids) and 1 - len(self._row_of) / len(self.doc_ids) > _COMPACT_RATIO:
+                self._compact()
+
+    def _compact(self):
+        """去掉死文档，行号重新编号"""
+        live = np.asarray(self.live)
+        new_row = np.cumsum(live) - 1
+        keep = live[np.asarray(self.post_docs)]
+        old_terms = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))[keep]
+
+        self.post_docs = new_row[np.asarray(self.post_docs)[keep]].astype(np.int32)
+        self.post_tf = np.asarray(self.post_tf)[keep]
+        counts = np.bincount(old_terms, minlength=len(self.vocab))
+        self.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.doc_len = np.asarray(self.doc_len)[live]
+        self.doc_ids = [cid for cid, alive in zip(self.doc_ids, live) if alive]
+        self.live = np.ones(len(self.doc_ids), dtype=bool)
+        self._row_of = {cid: row for row, cid in enumerate(self.doc_ids)}
+
+    def sync(self, ids: Sequence[str], texts: Sequence[str]) -> bool:
+        """
+        让索引与向量库中的 chunk 集合一致：补齐缺失的、删除多余的。有变化时返回 True（需要 save）
+        """
+        with self._lock:
+            self._ensure_loaded()
+            wanted = set(ids)
+            stale = [cid for cid in self._row_of if cid not in wanted]
+            missing = [(cid, text) for cid, text in zip(ids, texts) if cid not in self._row_of]
+            if stale:
+                self.delete(stale)
+            if missing:
+                self.add([cid for cid, _ in missing], [text for _, text in missing])
+            return bool(stale or missing)
+
+    # =====================================================================
+    # 检索
+    # =====================================================================
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._row_of)
+
+    def engine(self) -> BM25Engine:
+        """当前版本的打分引擎（索引有增删时自动重建）"""
+        self._ensure_loaded()
+        with self._lock:
+            if self._engine is None:
+                self._engine = BM25Engine(
+                    self.vocab, self.indptr, self.post_docs, self.post_tf,
+                    self.doc_len, self.live, k1=self.k1, b=self.b,
+                )
+            return self._engine
+
+    def search_batch(self, queries: Sequence[str], k: int = 20) -> List[List[Tuple[str, float]]]:
+        """
+        一批 query 一次打分，返回每个 query 的 [(chunk_id, score), ...]（降序，只含分数 > 0 的文档）
+        """
+        if k <= 0:
+            return [[] for _ in queries]
+        self._ensure_loaded()
+        if not self._row_of:
+            return [[] for _ in queries]
+        rows, scores = self.engine().top_k(list(queries), k)
+        return [
+            [(self.doc_ids[r], float(sc)) for r, sc in zip(row_ids, row_scores) if sc > 0]
+            for row_ids, row_scores in zip(rows.tolist(), scores.tolist())
+        ]
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        return self.search_batch([query], k)[0]
+
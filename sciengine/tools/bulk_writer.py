@@ -0,0 +1,156 @@
+# sciengine/tools/bulk_writer.py
+"""
+向量库批量写入。
+建库时不再逐篇写入：多篇论文的 chunk 先累积，凑满一批（SCI_INDEX_BATCH_SIZE，默认 512）后
+一次编码、一次写入向量库与 BM25 索引；全部论文处理完后统一 flush 一次，可选构建 ANN 索引，
+并输出 chunks/s 吞吐。
+同一个 writer 持有唯一的向量库句柄，调用方只需 add_paper / close；
+并发管线（con_sci_embedding / run_RAG）中由 worker 负责编码，writer 线程用 add_embedded 提交，
+已编码的 chunk 同样攒满一批再写入。
+chunk metadata 的 source 标记内容来源（fulltext / abstract）：只有摘要入库的论文，
+之后拿到全文时会再次入库：写入全文 chunk 前，按 paper_key 从向量库与 BM25 中删除其摘要 chunk。
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sciengine.tools.bm25_index import BM25Index
+from sciengine.tools.vector_store import VectorStore
+
+DEFAULT_BATCH_SIZE = int(os.getenv("SCI_INDEX_BATCH_SIZE", 512))
+
+SOURCE_FULLTEXT = "fulltext"
+SOURCE_ABSTRACT = "abstract"
+
+
+class BulkIndexWriter:
+    def __init__(self, store: VectorStore, bm25_index: BM25Index, embedding,
+                 batch_size: Optional[int] = None):
+        self.store = store
+        self.bm25_index = bm25_index
+        self.embedding = embedding
+        self.batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+        # 已有全文入库的论文（含本次已提交的）整篇跳过；没有 source 的早期 chunk 视为全文
+        abstract = store.metadata_values("paper_key", where={"source": SOURCE_ABSTRACT})
+        self.indexed = (store.metadata_values("paper_key", where={"source": SOURCE_FULLTEXT})
+                        | (store.metadata_values("paper_key") - abstract))
+        # 只有摘要入库的论文，拿到全文时需要重新入库
+        self.abstract_only = abstract - self.indexed
+        # 升级为全文、写入前需删除已入库摘要 chunk 的论文
+        self._replace: set = set()
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metas: List[Dict[str, Any]] = []
+        # 与 _ids 对齐；None 表示尚未编码（add_paper 提交的 chunk）
+        self._vectors: List[Optional[List[float]]] = []
+
+        self.papers = 0
+        self.chunks = 0
+        self.embed_seconds = 0.0
+        self.write_seconds = 0.0
+        self._start = time.perf_counter()
+
+    def is_indexed(self, key: Optional[str], source: str = SOURCE_FULLTEXT) -> bool:
+        """source=fulltext：是否已有全文入库；source=abstract：全文或摘要任一已入库即可"""
+        if key is None:
+            return False
+        return key in self.indexed or (source == SOURCE_ABSTRACT and key in self.abstract_only)
+
+    def _register(self, key: Optional[str], metas: List[Dict[str, Any]]):
+        if key is None:
+            raise ValueError("论文没有可用的标识（pmcid / pubmed_url / title / 内容），不能入库")
+        if metas and metas[0].get("source") == SOURCE_ABSTRACT:
+            self.abstract_only.add(key)
+        else:
+            if key in self.abstract_only:
+                self._replace.add(key)
+                self._drop_buffered(key)
+            self.indexed.add(key)
+            self.abstract_only.discard(key)
+
+    def _drop_buffered(self, key: str):
+        """丢弃缓冲区中尚未写入的该论文摘要 chunk"""
+        keep = [i for i, m in enumerate(self._metas)
+                if not (m.get("paper_key") == key and m.get("source") == SOURCE_ABSTRACT)]
+        if len(keep) == len(self._ids):
+            return
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metas = [self._metas[i] for i in keep]
+        self._vectors = [self._vectors[i] for i in keep]
+
+    def add_paper(self, key: str, ids: List[str], chunks: List[str], metas: List[Dict[str, Any]]):
+        """累积一篇论文的 chunk，攒满一批时写入"""
+        with self._lock:
+            self._register(key, metas)
+            self._ids.extend(ids)
+            self._texts.extend(chunks)
+            self._metas.extend(metas)
+            self._vectors.extend([None] * len(ids))
+            self.papers += 1
+            if len(self._ids) >= self.batch_size:
+                self._write_batch()
+
+    def add_embedded(self, key: str, ids: List[str], chunks: List[str], metas: List[Dict[str, Any]],
+                     embeddings):
+        """累积已编码好的一篇论文的 chunk，攒满一批时写入（并发管线中由唯一的 writer 线程调用）"""
+        with self._lock:
+            self._register(key, metas)
+            self._ids.extend(ids)
+            self._texts.extend(chunks)
+            self._metas.extend(metas)
+            self._vectors.extend(list(embeddings))
+            self.papers += 1
+            if len(self._ids) >= self.batch_size:
+                self._write_batch()
+
+    def _write_batch(self):
+        if not self._ids:
+            return
+        ids, texts, metas, embeddings = self._ids, self._texts, self._metas, self._vectors
+        self._ids, self._texts, self._metas, self._vectors = [], [], [], []
+
+        t0 = time.perf_counter()
+        # 只编码 add_paper 提交的部分，add_embedded 的向量直接使用
+        pending = [i for i, v in enumerate(embeddings) if v is None]
+        if pending:
+            for i, vector in zip(pending, self.embedding.embed_documents([texts[i] for i in pending])):
+                embeddings[i] = vector
+        t1 = time.perf_counter()
+        for key in self._replace:
+            removed = self.store.delete({"paper_key": key, "source": SOURCE_ABSTRACT})
+            self.bm25_index.delete(removed)
+        self._replace.clear()
+        self.store.add(ids, texts, metas, embeddings)
+        self.bm25_index.add(ids, texts)
+        t2 = time.perf_counter()
+
+        self.embed_seconds += t1 - t0
+        self.write_seconds += t2 - t1
+        self.chunks += len(ids)
+        print(f"[BulkWriter] 已写入 {self.chunks} 个 chunk（本批 {len(ids)}，"
+              f"编码 {t1 - t0:.2f}s，写入 {t2 - t1:.2f}s）")
+
+    def close(self, build_index: bool = True) -> Dict[str, float]:
+        """写入剩余 chunk，可选构建索引，统一落盘一次，返回吞吐统计"""
+        with self._lock:
+            self._write_batch()
+            if build_index:
+                self.store.build_index()
+            self.store.persist()
+            self.bm25_index.save()
+
+        elapsed = time.perf_counter() - self._start
+        stats = {
+            "papers": self.papers,
+            "chunks": self.chunks,
+            "seconds": elapsed,
+            "embed_seconds": self.embed_seconds,
+            "write_seconds": self.write_seconds,
+            "chunks_per_second": self.chunks / elapsed if elapsed > 0 else 0.0,
+        }
+        print(f"[BulkWriter] 完成：{self.papers} 篇论文 / {self.chunks} 个 chunk，"
+              f"耗时 {elapsed:.2f}s，{stats['chunks_per_second']:.1f} chunks/s")
+        return stats
@@ -3,21 +3,29 @@
 RAG的嵌入模块。
 PubMed_url → Pmcid_url → 全文 → 切块 → 向量库
 embedding model: bioembedding
-vector database: chroma
-[将全文并发嵌入向量数据库]
+vector database: chroma（或其他 vector_store 后端）
+[多个 worker 并发切块 / 编码，经有界队列交给唯一的 writer 写入向量数据库]
 """
 import os
-import trafilatura
+import json
+import queue
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from sciengine.model.bioembedding_model import BioBERTEmbeddings
+from sciengine.model.registry import get_embedding_model
 from sciengine.tools import pubmed_to_pmc
+from sciengine.tools.vector_store import open_vector_store
+from sciengine.tools.bm25_index import BM25Index
+from sciengine.tools.bulk_writer import BulkIndexWriter, SOURCE_FULLTEXT
+from sciengine.tools.http_client import fetch_text
+from sciengine.tools.pmc_fulltext import fetch_jats_batch, normalize_pmcid, sections_to_text
+from sciengine.tools.sci_embedding import extract_pubmed_titles, paper_key, make_chunk_ids
 from concurrent.futures import ThreadPoolExecutor
-import tempfile
 import asyncio
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from sciengine.model.llm_models import get_chat_model
 
+# worker → writer 队列上限（批次数，每批是一篇论文的 chunk + 向量）
+WRITE_QUEUE_SIZE = int(os.getenv("SCI_WRITE_QUEUE_SIZE", 8))
+
 
 class Pubmed_RAG:
     """
@@ -29,7 +37,7 @@ class Pubmed_RAG:
     """
 
     def __init__(self):
-        self.embedding = BioBERTEmbeddings()
+        self.embedding = get_embedding_model()
         self.llm = get_chat_model()
         self.persist_directory = "./chroma_papers"
 
@@ -64,7 +72,7 @@ class Pubmed_RAG:
                     urls.append(url)
 
         # 去重
-        urls = list(set(urls))
+        urls = list(dict.fromkeys(urls))
 
         print(f"✅ 共提取到 {len(urls)} 条 PubMed 链接")
         return urls
@@ -72,17 +80,14 @@ class Pubmed_RAG:
     # =====================================================================
     # ① PubMed → PMC
     # =====================================================================
-    def batch_get_pmcid(self, urls: List[str]) -> List[Dict[str, Any]]:
+    def batch_get_pmcid(self, urls: List[str], titles: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """批量 ID 转换（一次请求最多 200 篇），失败的逐篇抓取 PubMed 页面兜底"""
         results = []
-        for url in urls:
-            try:
-                res = pubmed_to_pmc.extract_pmc_link_from_pubmed(url)
-                if res:
-                    results.append(res)
-                else:
-                    print(f"[WARN] 无法解析 {url}")
-            except Exception as e:
-                print(f"[ERROR] {url}: {e}")
+        for url, res in pubmed_to_pmc.resolve_pubmed_urls(urls, titles).items():
+            if res:
+                results.append(res)
+            else:
+                print(f"[WARN] 无法解析 {url}")
         return results
 
     # =====================================================================
@@ -96,18 +101,33 @@ class Pubmed_RAG:
         valid_items = [item for item in pmcid_items if item.get("pmc_url")]
 
         print(f"开始下载 {len(valid_items)} 篇 PMC 全文...")
+        # 先批量取 JATS XML（按章节），没有 XML 正文的再下载 HTML
+        articles = fetch_jats_batch([item.get("pmcid") or item["pmc_url"] for item in valid_items])
 
         for i, item in enumerate(valid_items, 1):
             pmc_url = item.get("pmc_url")
             pubmed_url = item.get("pubmed_url", "")
-            title = item.get("title", "Unknown Title")
+            # ID 转换结果没有标题时 title 为 None
+            title = item.get("title") or "Unknown Title"
+
+            article = articles.get(normalize_pmcid(item.get("pmcid") or pmc_url))
+            if article is not None:
+                results.append({
+                    "pubmed_url": pubmed_url,
+                    "pmcid": pmc_url,
+                    "title": title,
+                    "content": sections_to_text(article["sections"]),
+                    "sections": article["sections"],
+                })
+                continue
 
             print(f"[{i}/{len(valid_items)}] 正在下载: {title[:60]}...")
             print(f"    PMC URL: {pmc_url}")
 
             try:
-                downloaded = trafilatura.fetch_url(pmc_url, timeout=30)
+                downloaded = fetch_text(pmc_url, timeout=30)
                 if downloaded:
+                    import trafilatura  # 延迟导入：只有 XML 全文取不到时才需要
                     text = trafilatura.extract(downloaded, include_comments=False, include_tables=True)
                     if text and len(text.strip()) > 200:  # 简单判断是否有效内容
                         print(f"    成功！共 {len(text)} 字符")
@@ -146,21 +166,20 @@ class Pubmed_RAG:
         return valid_results
 
     # ==============================================================
-    # ① 单个文章处理函数（同步，线程安全）
+    # ① 单个文章处理函数（worker 线程：切块 + 编码，不碰向量库）
     # ==============================================================
     def _process_one_paper(
+            self,
             paper: Dict[str, Any],
             splitter: RecursiveCharacterTextSplitter,
-            embedding,
-            temp_dir: str,
             method_name: str  # "fixed" or "par"
     ) -> Dict[str, Any]:
         """
-        处理一篇论文：切块 → 写入临时 Chroma → 返回临时路径
+        处理一篇论文：切块 → 编码 → 返回 (ids, texts, metadatas, embeddings) 批次
         """
         idx = paper.get("idx", -1)
         content = paper.get("content")
-        title = paper.get("title", "Unknown Title")
+        title = paper.get("title") or "Unknown Title"
 
         if not content or not isinstance(content, str):
             return {"idx": idx, "status": "skipped", "reason": "no content"}
@@ -168,39 +187,39 @@ class Pubmed_RAG:
         print(f"[{method_name}] 正在处理 #{idx + 1}: {title}")
 
         try:
-            # 切片
-            chunks = splitter.split_text(content)
-            if not chunks:
+            # 切片；有章节（JATS XML）时逐章节切分，chunk 不跨章节
+            if paper.get("sections"):
+                pieces = [(c, section["title"]) for section in paper["sections"]
+                          for c in splitter.split_text(section["text"])]
+            else:
+                pieces = [(c, None) for c in splitter.split_text(content)]
+            if not pieces:
                 return {"idx": idx, "status": "skipped", "reason": "empty chunks"}
 
+            chunks = [c for c, _ in pieces]
+            key = paper_key(paper)
             # metadata
-            metas = [
-                {
+            metas = []
+            for _, section in pieces:
+                meta = {
                     "pmcid": paper.get("pmcid"),
                     "title": title,
-                    "pubmed_url": paper.get("pubmed_url")
+                    "pubmed_url": paper.get("pubmed_url"),
+                    "paper_key": key,
+                    "source": SOURCE_FULLTEXT
                 }
-                for _ in chunks
-            ]
-
-            # 临时向量库路径（每篇一个）
-            temp_db_path = os.path.join(temp_dir, f"temp_db_{idx}_{os.getpid()}_{id(paper)}")
-            os.makedirs(temp_db_path, exist_ok=True)
-            print(temp_db_path)
+                if section:
+                    meta["section"] = section
+                metas.append(meta)
 
-            # 写入临时库
-            Chroma.from_texts(
-                texts=chunks,
-                metadatas=metas,
-                embedding=embedding,
-                persist_directory=temp_db_path
-            )
-
-            print(f"[{method_name}] 已写入 {len(chunks)} 个 chunk → {temp_db_path}")
             return {
                 "idx": idx,
                 "status": "success",
-                "temp_path": temp_db_path,
+                "key": key,
+                "ids": make_chunk_ids(key, chunks),
+                "texts": chunks,
+                "metadatas": metas,
+                "embeddings": self.embedding.embed_documents(chunks),
                 "chunk_count": len(chunks)
             }
 
@@ -209,91 +228,82 @@ class Pubmed_RAG:
             return {"idx": idx, "status": "error", "reason": str(e)}
 
     # ==============================================================
-
-    # ① 并发，构建向量数据库-固定长度
+    # ① 并发管线：多个 worker 编码 → 有界队列 → 唯一 writer 写主库
     # ==============================================================
-    async def create_VDB_fixed(self, papers: List[Dict[str, Any]]):
+    async def _build_concurrently(self, papers: List[Dict[str, Any]],
+                                  splitter: RecursiveCharacterTextSplitter, method_name: str):
         """
-        并发版：每篇文章并发处理，固定长度切块
+        worker 线程把每篇论文编码成一批 (ids, texts, metadatas, embeddings) 放进有界队列，
+        writer 线程逐批 upsert 到主库（同一个向量库句柄），全部写完后统一落盘一次。
+        队列满时 worker 阻塞，编码速度不会把内存撑爆；不再有临时库与合并阶段。
         """
-        print("Starting 并发向量库构建 (create_VDB_fixed)")
         os.makedirs(self.persist_directory, exist_ok=True)
+        store = open_vector_store(self.persist_directory, embedding=self.embedding)
+        bm25_index = BM25Index.for_chroma_dir(self.persist_directory)
+        writer = BulkIndexWriter(store, bm25_index, self.embedding)
+
+        papers_with_idx = [{**p, "idx": i} for i, p in enumerate(papers)
+                           if not writer.is_indexed(paper_key(p))]
+        total = len(papers_with_idx)
+        if len(papers) > total:
+            print(f"[{method_name}] 跳过 {len(papers) - total} 篇已入库的论文")
+        max_workers = max(1, min(6, total, os.cpu_count() or 1))
+        print(f"Using {max_workers} threads for {total} papers")
+
+        batches: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+
+        def write_loop():
+            while True:
+                res = batches.get()
+                if res is None:
+                    return
+                try:
+                    writer.add_embedded(res["key"], res["ids"], res["texts"],
+                                        res["metadatas"], res["embeddings"])
+                except Exception as e:
+                    print(f"[{method_name}] 写入失败 #{res['idx'] + 1}: {e}")
 
-        # 固定长度切块
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=300,
-            chunk_overlap=50
-        )
-
-        # 临时目录
-        with tempfile.TemporaryDirectory() as temp_root:
-            temp_dir = os.path.join(temp_root, "chroma_temp")
-            os.makedirs(temp_dir, exist_ok=True)
-
-            papers_with_idx = [{**p, "idx": i} for i, p in enumerate(papers)]
-            total = len(papers_with_idx)
-            max_workers = min(6, total, os.cpu_count() or 1)
-            print(f"Using {max_workers} threads for {total} papers")
-
-            results = []
-            loop = asyncio.get_event_loop()
+        def produce(paper):
+            res = self._process_one_paper(paper, splitter, method_name)
+            if res["status"] == "success":
+                batches.put(res)  # 队列满时阻塞（背压）
+            return res
 
+        loop = asyncio.get_running_loop()
+        writer_future = loop.run_in_executor(None, write_loop)
+        try:
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [
-                    loop.run_in_executor(
-                        executor,
-                        _process_one_paper,
-                        paper,
-                        splitter,
-                        self.embedding,
-                        temp_dir,
-                        "fixed"
-                    )
-                    for paper in papers_with_idx
-                ]
-
-                for i, future in enumerate(futures, 1):
+                futures = [loop.run_in_executor(executor, produce, paper) for paper in papers_with_idx]
+                for i, future in enumerate(asyncio.as_completed(futures), 1):
                     res = await future
-                    results.append(res)
                     if res["status"] == "success":
                         print(f"Completed {i}/{total}: {res['chunk_count']} chunks")
                     else:
                         print(f"Failed {i}/{total}: {res.get('reason', 'unknown')}")
+        finally:
+            batches.put(None)
+            await writer_future
 
-            # ========== 合并所有临时库 ==========
-            print("Merging all temporary DBs...")
-            main_db = None
-            merged_count = 0
+        stats = writer.close()
+        print(f"Vector DB 构建完成！本次写入 {stats['chunks']} 个 chunks")
+        print(f"Main DB: {self.persist_directory}")
+        return stats
 
-            for res in results:
-                if res["status"] != "success":
-                    continue
-                temp_path = res["temp_path"]
-                try:
-                    temp_db = Chroma(persist_directory=temp_path, embedding_function=self.embedding)
-                    if main_db is None:
-                        import shutil
-                        shutil.rmtree(self.persist_directory, ignore_errors=True)
-                        shutil.copytree(temp_path, self.persist_directory)
-                        main_db = Chroma(persist_directory=self.persist_directory, embedding_function=self.embedding)
-                        merged_count += res["chunk_count"]
-                    else:
-                        docs = temp_db._collection.get(include=["documents", "metadatas", "embeddings"])
-                        if docs["ids"]:
-                            main_db._collection.add(
-                                ids=docs["ids"],
-                                documents=docs["documents"],
-                                metadatas=docs["metadatas"],
-                                embeddings=docs["embeddings"]
-                            )
-                            merged_count += len(docs["ids"])
-                    import shutil
-                    shutil.rmtree(temp_path, ignore_errors=True)
-                except Exception as e:
-                    print(f"Merge failed: {e}")
+    # ==============================================================
+    # ① 并发，构建向量数据库-固定长度
+    # ==============================================================
+    async def create_VDB_fixed(self, papers: List[Dict[str, Any]]):
+        """
+        并发版：每篇文章并发处理，固定长度切块
+        """
+        print("Starting 并发向量库构建 (create_VDB_fixed)")
 
-            print(f"Vector DB 合并完成！总计 {merged_count} 个 chunks")
-            print(f"Main DB: {self.persist_directory}")
+        # 固定长度切块
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=300,
+            chunk_overlap=50
+        )
+        return await self._build_concurrently(papers, splitter, "fixed")
 
     # ==============================================================
     # ① 并发，构建向量数据库-段落
@@ -304,7 +314,6 @@ class Pubmed_RAG:
         并发版：每篇文章并发处理，优先按段落切块
         """
         print("Starting 并发向量库构建 (create_VDB_par)")
-        os.makedirs(self.persist_directory, exist_ok=True)
 
         # 优先按段落切块
         splitter = RecursiveCharacterTextSplitter(
@@ -312,82 +321,7 @@ class Pubmed_RAG:
             chunk_size=300,
             chunk_overlap=50
         )
-
-        # 临时目录（所有临时向量库）
-        with tempfile.TemporaryDirectory() as temp_root:
-            temp_dir = os.path.join(temp_root, "chroma_temp")
-            print(temp_dir)
-            os.makedirs(temp_dir, exist_ok=True)
-
-            # 添加索引
-            papers_with_idx = [{**p, "idx": i} for i, p in enumerate(papers)]
-
-            total = len(papers_with_idx)
-            max_workers = min(6, total, os.cpu_count() or 1)
-            print(f"Using {max_workers} threads for {total} papers")
-
-            results = []
-            loop = asyncio.get_event_loop()
-
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [
-                    loop.run_in_executor(
-                        executor,
-                        _process_one_paper,
-                        paper,
-                        splitter,
-                        self.embedding,
-                        temp_dir,
-                        "par"
-                    )
-                    for paper in papers_with_idx
-                ]
-
-                for i, future in enumerate(futures, 1):
-                    res = await future
-                    results.append(res)
-                    if res["status"] == "success":
-                        print(f"Completed {i}/{total}: {res['chunk_count']} chunks")
-                    else:
-                        print(f"Failed {i}/{total}: {res.get('reason', 'unknown')}")
-
-            # ========== 合并所有临时库到主库 ==========
-            print("Merging all temporary DBs into main DB...")
-            main_db = None
-            merged_count = 0
-
-            for res in results:
-                if res["status"] != "success":
-                    continue
-                temp_path = res["temp_path"]
-                try:
-                    temp_db = Chroma(persist_directory=temp_path, embedding_function=self.embedding)
-                    if main_db is None:
-                        # 第一个成功的临时库 → 直接迁移为主库
-                        import shutil
-                        shutil.rmtree(self.persist_directory, ignore_errors=True)
-                        shutil.copytree(temp_path, self.persist_directory)
-                        main_db = Chroma(persist_directory=self.persist_directory, embedding_function=self.embedding)
-                        merged_count += res["chunk_count"]
-                    else:
-                        # 后续库：使用 merge_from
-                        docs = temp_db._collection.get(include=["documents", "metadatas", "embeddings"])
-                        if docs["ids"]:
-                            main_db._collection.add(
-                                ids=docs["ids"],
-                                documents=docs["documents"],
-                                metadatas=docs["metadatas"],
-                                embeddings=docs["embeddings"]
-                            )
-                            merged_count += len(docs["ids"])
-                    # 清理临时
-                    import shutil
-                    shutil.rmtree(temp_path, ignore_errors=True)
-                except Exception as e:
-                    print(f"Merge failed for temp {temp_path}: {e}")
-
-            print(f"Vector DB 合并完成！总计 {merged_count} 个 chunks 写入主库")
-            print(f"Main DB: {self.persist_directory}")
+        return await self._build_concurrently(papers, splitter, "par")
 
     # =====================================================================
     # 执行全部程序
@@ -396,13 +330,13 @@ class Pubmed_RAG:
         pubmed_urls = self.extract_pubmed_urls_from_tasks(state["search_results"])
         print("已提取 pubmed 链接")
 
-        pmcid_urls = self.batch_get_pmcid(pubmed_urls)
+        pmcid_urls = self.batch_get_pmcid(pubmed_urls, extract_pubmed_titles(state["search_results"]))
         print("已提取 pmcid 链接")
 
         paper_content = self.get_paper_content(pmcid_urls)
         print("已获取 paper content")
 
-        self.create_VDB_par(paper_content)
+        asyncio.run(self.create_VDB_par(paper_content))
         print("已构建向量数据库")
 
         state["paper_content"] = paper_content
@@ -0,0 +1,211 @@
+# sciengine/tools/http_cache.py
+"""
+HTTP 响应磁盘缓存（E-utilities / ID 转换 / PubMed / PMC 全文）。
+相关主题的检索会反复发出相同的 esearch / efetch / esummary 与 PMC 文章请求，这里按请求缓存响应：
+- 键：规范化后的 URL + 参数（host 小写、参数排序、去掉 api_key 等与内容无关的参数）的 sha256
+- 多 id 的批量接口（ID 转换 / efetch）按单个 id 缓存（cache_lookup / cache_store），
+  批次的组成与顺序随查询变化，按批次 URL 缓存几乎不会命中
+- 正文 zlib 压缩后存为 <dir>/<key[:2]>/<key>.z，索引（状态码 / 头 / 大小 / 时间）存 sqlite
+- 按接口设置 TTL：esearch 1 天，esummary / PubMed 页面 7 天，efetch / ID 转换 30 天，
+  PMC 全文（PMC 文章页面与 efetch db=pmc）90 天
+- 总大小超过上限（SCI_HTTP_CACHE_MAX_MB，默认 1024）时按最近访问时间淘汰
+- 离线回放（SCI_HTTP_OFFLINE=1）：忽略 TTL 只读缓存，未命中直接报错，不访问网络，用于可复现的基准测试
+配置：SCI_HTTP_CACHE=0 关闭，SCI_HTTP_CACHE_DIR 缓存目录（默认 ./http_cache）
+只缓存 GET 的 200 响应。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+
+# 不参与缓存键的参数
+IGNORED_PARAMS = {"api_key", "email", "tool"}
+
+DAY = 86400.0
+# (host + path 匹配规则, 必须相等的参数, TTL 秒)，按顺序匹配
+ENDPOINT_TTLS = [
+    ("eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch", {}, 1 * DAY),
+    ("eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary", {}, 7 * DAY),
+    ("eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch", {"db": "pmc"}, 90 * DAY),
+    ("eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch", {}, 30 * DAY),
+    ("/pmc/utils/idconv/", {}, 30 * DAY),
+    ("pmc.ncbi.nlm.nih.gov/articles/", {}, 90 * DAY),
+    ("pubmed.ncbi.nlm.nih.gov/", {}, 7 * DAY),
+]
+DEFAULT_TTL = 1 * DAY
+
+
+class OfflineCacheMiss(httpx.RequestError):
+    """离线回放模式下缓存未命中"""
+
+
+def canonical_url(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """合并 URL 自带参数与 params，host 小写、参数排序、去掉 IGNORED_PARAMS"""
+    merged = httpx.URL(url).copy_merge_params(params or {})
+    query = sorted((k, v) for k, v in merged.params.multi_items() if k not in IGNORED_PARAMS)
+    return str(merged.copy_with(host=merged.host.lower(), query=urlencode(query).encode("ascii"),
+                                fragment=None))
+
+
+def ttl_for(url: str) -> float:
+    parsed = httpx.URL(url)
+    target = parsed.host + parsed.path
+    for pattern, required, ttl in ENDPOINT_TTLS:
+        if pattern in target and all(parsed.params.get(k) == v for k, v in required.items()):
+            return ttl
+    return DEFAULT_TTL
+
+
+class HttpCache:
+    def __init__(self, cache_dir: str = "./http_cache", max_bytes: int = 1024 * 1024 * 1024,
+                 offline: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False,
+                                   timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT,"
+            " size INTEGER, created REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON entries(accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(url: str, params: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+        """返回 (缓存键, 规范化 URL)"""
+        canonical = canonical_url(url, params)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), canonical
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".z")
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> Optional[httpx.Response]:
+        """命中且未过期（离线模式不看 TTL）时返回重建的 Response，否则返回 None"""
+        key, canonical = self.make_key(url, params)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            fresh = row is not None and (self.offline or time.time() - row[2] <= ttl_for(canonical))
+            body = None
+            if fresh:
+                try:
+                    with open(self._body_path(key), "rb") as f:
+                        body = zlib.decompress(f.read())
+                except (OSError, zlib.error):
+                    body = None
+            if body is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+
+        headers = json.loads(row[1])
+        # 正文已解压，去掉与原始传输相关的头
+        for name in ("content-encoding", "content-length", "transfer-encoding"):
+            headers.pop(name, None)
+        return httpx.Response(row[0], headers=headers, content=body,
+                              request=httpx.Request("GET", canonical))
+
+    def put(self, url: str, params: Optional[Dict[str, Any]], response: httpx.Response):
+        if response.status_code != 200:
+            return
+        key, canonical = self.make_key(url, params)
+        data = zlib.compress(response.content, 6)
+        path = self._body_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        headers = {k.lower(): v for k, v in response.headers.items()
+                   if k.lower() in ("content-type", "last-modified", "etag")}
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, canonical, response.status_code, json.dumps(headers), len(data), now, now),
+            )
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        """超过上限时按最近访问时间淘汰到上限的 90%"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        removed = 0
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if total <= target:
+                break
+            try:
+                os.remove(self._body_path(key))
+            except OSError:
+                pass
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        self._db.commit()
+        print(f"[HttpCache] 淘汰 {removed} 条缓存，当前 {total / 1e6:.1f} MB")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": count,
+                "bytes": size,
+            }
+
+
+_cache: Optional[HttpCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> Optional[HttpCache]:
+    """按环境变量创建进程内唯一的缓存；SCI_HTTP_CACHE=0 时返回 None（离线模式下总是启用）"""
+    global _cache
+    offline = os.getenv("SCI_HTTP_OFFLINE", "0") == "1"
+    if not offline and os.getenv("SCI_HTTP_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = HttpCache(
+                    cache_dir=os.getenv("SCI_HTTP_CACHE_DIR", "./http_cache"),
+                    max_bytes=int(float(os.getenv("SCI_HTTP_CACHE_MAX_MB", 1024)) * 1024 * 1024),
+                    offline=offline,
+                )
+    return _cache
+
+
+def cache_lookup(url: str, params: Optional[Dict[str, Any]] = None) -> Optional[httpx.Response]:
+    """按单个 id 的请求查缓存（批量接口用）；缓存关闭或未命中返回 None"""
+    cache = get_http_cache()
+    return cache.get(url, params) if cache is not None else None
+
+
+def cache_store(url: str, params: Optional[Dict[str, Any]], content: bytes, content_type: str):
+    """把批量响应中拆出的单个 id 的结果，按单个 id 的请求写入缓存"""
+    cache = get_http_cache()
+    if cache is not None:
+        cache.put(url, params, httpx.Response(200, headers={"content-type": content_type}, content=content))
@@ -0,0 +1,200 @@
+# sciengine/tools/http_client.py
+"""
+全进程共享的异步 HTTP 层（httpx）。
+所有 NCBI E-utilities / PubMed / PMC 请求都走这里，不再各自 requests.get 新建连接：
+- 一个后台事件循环线程持有唯一的 httpx.AsyncClient，连接池 keep-alive 复用，省掉重复的 TLS 握手
+- 安装了 h2 时启用 HTTP/2（同一 host 的并发请求复用一条连接）
+- 每个 host 的并发连接数有上限（SCI_HTTP_PER_HOST，默认 6），总连接数 SCI_HTTP_MAX_CONNECTIONS
+- 统一超时：连接 SCI_HTTP_CONNECT_TIMEOUT（默认 10s），读取 SCI_HTTP_TIMEOUT（默认 30s）
+- NCBI 域名的请求先从共享令牌桶取令牌（见 rate_limiter.py）；429 / 5xx / 网络错误按
+  Retry-After 或指数退避（含抖动）重试，最多 SCI_HTTP_RETRIES 次，429 会让所有进程一起暂停
+- GET 先查磁盘响应缓存（见 http_cache.py），命中时不占令牌也不访问网络；离线回放模式下未命中抛 OfflineCacheMiss。
+  按单个 id 自行缓存的批量请求传 cache=False，跳过整批响应的缓存
+调用方式：
+    同步（线程池 / 流水线 worker / LangChain tool）: http_get(url, params=...)
+    异步（任意事件循环）:                          await aget(url, params=...)
+返回 httpx.Response；网络错误抛 httpx.HTTPError（raise_for_status 抛 httpx.HTTPStatusError）
+"""
+import asyncio
+import atexit
+import os
+import random
+import threading
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from sciengine.tools.http_cache import OfflineCacheMiss, get_http_cache
+from sciengine.tools.rate_limiter import limiter_for_url, parse_retry_after
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+PER_HOST_LIMIT = int(os.getenv("SCI_HTTP_PER_HOST", 6))
+MAX_CONNECTIONS = int(os.getenv("SCI_HTTP_MAX_CONNECTIONS", 64))
+CONNECT_TIMEOUT = float(os.getenv("SCI_HTTP_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.getenv("SCI_HTTP_TIMEOUT", 30))
+MAX_RETRIES = int(os.getenv("SCI_HTTP_RETRIES", 4))
+BACKOFF_BASE = float(os.getenv("SCI_HTTP_BACKOFF", 0.5))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (sciengine)",
+}
+
+
+class SharedHttpClient:
+    """后台事件循环 + 单个 AsyncClient；按 host 用信号量限制并发"""
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="http-client", daemon=True)
+        self._thread.start()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._ready = asyncio.run_coroutine_threadsafe(self._open(), self._loop)
+        self._ready.result()
+
+    async def _open(self):
+        self._client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            headers=DEFAULT_HEADERS,
+            follow_redirects=True,
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_CONNECTIONS),
+        )
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        # 只在后台事件循环中调用，无需加锁
+        host = urlsplit(url).netloc
+        sem = self._host_limits.get(host)
+        if sem is None:
+            sem = self._host_limits[host] = asyncio.Semaphore(PER_HOST_LIMIT)
+        return sem
+
+    async def _request(self, method: str, url: str, use_cache: bool = True, **kwargs) -> httpx.Response:
+        cache = get_http_cache() if method == "GET" else None
+        if cache is not None and not use_cache:
+            if cache.offline:
+                raise OfflineCacheMiss(f"离线回放模式缓存未命中: {url}")
+            cache = None
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, url, kwargs.get("params"))
+            if cached is not None:
+                return cached
+            if cache.offline:
+                raise OfflineCacheMiss(f"离线回放模式缓存未命中: {url}")
+
+        response = await self._send(method, url, **kwargs)
+        if cache is not None and response.status_code == 200:
+            await asyncio.to_thread(cache.put, url, kwargs.get("params"), response)
+        return response
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        limiter = limiter_for_url(url)
+        for attempt in range(MAX_RETRIES + 1):
+            if limiter is not None:
+                await limiter.acquire_async()
+            try:
+                async with self._host_semaphore(url):
+                    response = await self._client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt)
+                print(f"[HTTP] {type(e).__name__} {url}，{delay:.1f}s 后重试（{attempt + 1}/{MAX_RETRIES}）")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            delay = retry_after if retry_after is not None else _backoff(attempt)
+            if response.status_code == 429 and limiter is not None:
+                # 限速命中：整个桶（所有进程）一起暂停
+                await asyncio.to_thread(limiter.penalize, delay)
+            print(f"[HTTP] {response.status_code} {url}，{delay:.1f}s 后重试（{attempt + 1}/{MAX_RETRIES}）")
+            await response.aclose()
+            await asyncio.sleep(delay)
+        return response
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """同步入口：在后台事件循环上执行并等待结果"""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("不能在 HTTP 事件循环线程内同步等待请求，请使用 aget")
+        return asyncio.run_coroutine_threadsafe(self._request(method, url, **kwargs), self._loop).result()
+
+    async def arequest(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """异步入口：调用方的事件循环不必是后台循环"""
+        future = asyncio.run_coroutine_threadsafe(self._request(method, url, **kwargs), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+
+
+_client: Optional[SharedHttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> SharedHttpClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SharedHttpClient()
+                atexit.register(_client.close)
+    return _client
+
+
+def http_get(url: str, params: Optional[Dict[str, Any]] = None,
+             headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+             cache: bool = True) -> httpx.Response:
+    kwargs: Dict[str, Any] = {"params": _clean_params(params), "headers": headers, "use_cache": cache}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    return get_http_client().request("GET", url, **kwargs)
+
+
+async def aget(url: str, params: Optional[Dict[str, Any]] = None,
+               headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None) -> httpx.Response:
+    kwargs: Dict[str, Any] = {"params": _clean_params(params), "headers": headers}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    return await get_http_client().arequest("GET", url, **kwargs)
+
+
+def fetch_text(url: str, timeout: Optional[float] = None) -> Optional[str]:
+    """取网页 HTML（替代 trafilatura.fetch_url）；非 2xx 或网络错误返回 None"""
+    try:
+        response = http_get(url, timeout=timeout)
+    except httpx.HTTPError as e:
+        print(f"[HTTP] 请求失败 {url}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"[HTTP] {response.status_code} {url}")
+        return None
+    return response.text
+
+
+def _backoff(attempt: int) -> float:
+    """指数退避 + 抖动"""
+    return BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+
+
+def _clean_params(params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # requests 会丢弃值为 None 的参数（如未设置的 api_key），httpx 不会，这里保持旧行为
+    if params is None:
+        return None
+    return {k: v for k, v in params.items() if v is not None}
@@ -0,0 +1,79 @@
+# sciengine/tools/hybrid_retriever.py
+"""
+稠密 + BM25 混合检索器（替代 EnsembleRetriever）。
+- 稠密召回（向量库 query）与关键词召回（BM25 稀疏矩阵乘）在线程池中并发执行，
+  两者的重活都在 NumPy / SciPy / Chroma 内部，基本不受 GIL 限制
+- 加权 RRF 融合只在整数行号上做：score(row) = Σ_i w_i / (c + rank_i)，与 EnsembleRetriever 的公式一致
+- 只为最终保留的行构建 Document
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+DEFAULT_WEIGHTS = (0.7, 0.3)  # 语义 > 关键词
+RRF_C = 60
+
+# 所有检索器共享的召回线程池（每次召回只有稠密 / 稀疏两个任务）
+_recall_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-recall")
+
+
+def weighted_rrf(rankings: Sequence[Sequence[int]], weights: Sequence[float],
+                 c: int = RRF_C) -> List[int]:
+    """
+    多路排名的加权 RRF 融合，输入 / 输出都是行号；分数相同时保持首次出现的顺序
+    """
+    scores: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] = scores.get(row, 0.0) + weight / (rank + c)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    语料（ids / documents / metadatas / id_to_row）来自 writing_tools 导出的向量库快照，
+    稠密结果与 BM25 结果都按 chunk id 映射到同一套行号
+    """
+    store: Any
+    bm25_index: Any
+    embedding: Any
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    id_to_row: Dict[str, int]
+    k: int = 20
+    weights: Sequence[float] = DEFAULT_WEIGHTS
+    c: int = RRF_C
+
+    def recall_rows_many(self, query_vecs: Sequence[Sequence[float]],
+                         queries: Sequence[str]) -> List[List[int]]:
+        """
+        一批 query 的混合召回：复用已算好的查询向量，稠密 / 稀疏并发，返回每个 query 融合后的候选行号
+        """
+        if not queries:
+            return []
+        dense_future = _recall_pool.submit(self.store.query, query_vecs, self.k)
+        sparse_future = _recall_pool.submit(self.bm25_index.search_batch, list(queries), self.k)
+        dense, sparse = dense_future.result(), sparse_future.result()
+
+        id_to_row = self.id_to_row
+        results = []
+        for dense_ids, sparse_hits in zip(dense, sparse):
+            dense_rows = [id_to_row[cid] for cid in dense_ids if cid in id_to_row]
+            sparse_rows = [id_to_row[cid] for cid, _ in sparse_hits if cid in id_to_row]
+            results.append(weighted_rrf([dense_rows, sparse_rows], self.weights, self.c))
+        return results
+
+    def row_to_doc(self, row: int) -> Document:
+        """按行号新建 Document（metadata 复制一份，调用方可随意修改）"""
+        return Document(id=self.ids[row], page_content=self.documents[row],
+                        metadata=dict(self.metadatas[row]))
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: Optional[CallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        rows = self.recall_rows_many([self.embedding.embed_query(query)], [query])[0]
+        return [self.row_to_doc(row) for row in rows]
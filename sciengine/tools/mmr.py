@@ -0,0 +1,94 @@
+# sciengine/tools/mmr.py
+"""
+NumPy 向量化 MMR（Maximal Marginal Relevance）。
+在召回候选的向量矩阵上做多样性选择，支持一次处理一批 query：
+    - 候选向量先 L2 归一化，相关度 / 候选间相似度都是矩阵乘
+    - 每个 query 的候选相似度矩阵由一次批量 matmul 得到，贪心选择只在 k 步内做数组运算
+位于 writing_tools 的 “混合召回 → MMR → BGE 精排” 之间。
+"""
+from typing import List, Sequence
+
+import numpy as np
+
+
+def l2_normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def batch_mmr(
+        query_vecs: np.ndarray,
+        candidate_vecs: Sequence[np.ndarray],
+        k: int = 15,
+        lambda_mult: float = 0.5,
+) -> List[List[int]]:
+    """
+    输入:
+        query_vecs: (Q, d) 查询向量
+        candidate_vecs: 长度为 Q 的列表，第 i 项为 (N_i, d) 候选向量（各 query 候选数可不同）
+        k: 每个 query 选出的文档数
+        lambda_mult: 1 → 只看相关度，0 → 只看多样性
+    输出:
+        每个 query 选中的候选下标列表（按选择顺序）
+    """
+    num_queries = len(candidate_vecs)
+    if num_queries == 0:
+        return []
+
+    dim = np.asarray(query_vecs).shape[-1]
+    max_n = max((len(c) for c in candidate_vecs), default=0)
+    k = min(int(k), max_n)
+    if k <= 0:
+        return [[] for _ in range(num_queries)]
+
+    # 候选补齐成 (Q, N, d)，mask 标记真实候选
+    cands = np.zeros((num_queries, max_n, dim), dtype=np.float32)
+    mask = np.zeros((num_queries, max_n), dtype=bool)
+    for i, c in enumerate(candidate_vecs):
+        n = len(c)
+        if n:
+            cands[i, :n] = c
+            mask[i, :n] = True
+
+    queries = l2_normalize(np.asarray(query_vecs, dtype=np.float32).reshape(num_queries, dim))
+    cands = l2_normalize(cands)
+
+    relevance = np.einsum("qd,qnd->qn", queries, cands)   # (Q, N)
+    pairwise = np.matmul(cands, cands.transpose(0, 2, 1))  # (Q, N, N)
+
+    rows = np.arange(num_queries)
+    selected = np.full((num_queries, k), -1, dtype=np.int64)
+    available = mask.copy()
+    redundancy = np.zeros((num_queries, max_n), dtype=np.float32)
+
+    for step in range(k):
+        # 第一步直接取最相关的候选
+        scores = relevance if step == 0 else lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores = np.where(available, scores, -np.inf)
+        picks = np.argmax(scores, axis=1)
+        valid = np.isfinite(scores[rows, picks])
+        if not valid.any():
+            break
+
+        selected[valid, step] = picks[valid]
+        available[rows[valid], picks[valid]] = False
+        # 只有本步有效选择的 query 才更新冗余度
+        picked_sim = pairwise[rows, picks]  # (Q, N)
+        redundancy = np.where(
+            valid[:, None],
+            np.maximum(redundancy, picked_sim) if step else picked_sim,
+            redundancy,
+        )
+
+    return [[int(i) for i in row if i >= 0] for row in selected]
+
+
+def mmr(query_vec: Sequence[float], candidate_vecs: np.ndarray,
+        k: int = 15, lambda_mult: float = 0.5) -> List[int]:
+    """单个 query 的便捷入口"""
+    return batch_mmr(
+        np.asarray(query_vec, dtype=np.float32)[None, :],
+        [np.asarray(candidate_vecs, dtype=np.float32)],
+        k=k,
+        lambda_mult=lambda_mult,
+    )[0]
@@ -0,0 +1,193 @@
+# sciengine/tools/mock_ncbi.py
+"""
+本地 NCBI mock 服务（测试 / 离线调试用，不访问外网）。
+提供：
+    GET /pmc/utils/idconv/v1.0/?ids=...&format=json   # ID 转换接口（JSON）
+    GET /entrez/eutils/efetch.fcgi?db=pmc&id=...      # PMC 全文 JATS XML（每篇两个章节）
+    GET /<pmid>/                                      # 最小 PubMed 页面（HTML 兜底解析用）
+用法：
+    with MockNCBIServer({"29844090": "PMC5973851", "12345": None}) as server:
+        os.environ["NCBI_IDCONV_URL"] = server.idconv_url
+        os.environ["NCBI_EUTILS_URL"] = server.eutils_url
+        ...
+        server.requests  # 已收到的请求路径，可断言批量请求次数
+        server.fail_next(2, status=429, retry_after=1)  # 模拟限速：接下来 2 个请求返回 429
+命令行：
+    python -m sciengine.tools.mock_ncbi --port 8765 --records records.json   # {pmid: pmcid 或 null}
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+IDCONV_PATH = "/pmc/utils/idconv/v1.0/"
+EUTILS_PATH = "/entrez/eutils/"
+
+
+class MockNCBIServer:
+    def __init__(self, records: Dict[str, Optional[str]], host: str = "127.0.0.1", port: int = 0,
+                 xml_withheld: Optional[List[str]] = None):
+        """
+        records: {pmid: pmcid}，pmcid 为 None 表示文章不在 PMC 中；不在 records 中的 PMID 视为无效 ID
+        xml_withheld: 出版方不允许下载 XML 全文的 pmcid（efetch 只返回 front，没有 body）
+        """
+        self.records = {str(k): v for k, v in records.items()}
+        self.xml_withheld = set(xml_withheld or [])
+        self.requests: List[str] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+        self._failures: List[tuple] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def idconv_url(self) -> str:
+        return self.url + IDCONV_PATH
+
+    @property
+    def eutils_url(self) -> str:
+        return self.url + EUTILS_PATH
+
+    def pubmed_url(self, pmid: str) -> str:
+        return f"{self.url}/{pmid}/"
+
+    def fail_next(self, count: int, status: int = 429, retry_after: Optional[float] = None):
+        """接下来 count 个请求返回 status（可带 Retry-After 头）"""
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def start(self) -> "MockNCBIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # =====================================================================
+    # 响应
+    # =====================================================================
+    def idconv(self, ids: List[str]) -> dict:
+        records = []
+        for pmid in ids:
+            if pmid not in self.records:
+                records.append({"pmid": pmid, "status": "error", "errmsg": "invalid article id"})
+            elif self.records[pmid] is None:
+                records.append({"pmid": pmid, "status": "error", "errmsg": "Identifier not found in PMC"})
+            else:
+                records.append({"pmid": pmid, "pmcid": self.records[pmid], "doi": f"10.0000/{pmid}"})
+        return {"status": "ok", "records": records}
+
+    def pubmed_page(self, pmid: str) -> str:
+        pmcid = self.records.get(pmid)
+        link = (f'<a data-ga-action="PMCID" href="https://pmc.ncbi.nlm.nih.gov/articles/{pmcid}/">{pmcid}</a>'
+                if pmcid else "")
+        return f'<html><body><h1 class="heading-title">Article {pmid}</h1>{link}</body></html>'
+
+    def efetch_pmc(self, ids: List[str]) -> str:
+        """最小 JATS：<pmc-articleset>，每篇含标题 / 摘要 / Introduction、Methods 两个章节"""
+        known = {pmcid for pmcid in self.records.values() if pmcid}
+        articles = []
+        for numeric in ids:
+            pmcid = f"PMC{numeric}"
+            if pmcid not in known:
+                continue
+            body = "" if pmcid in self.xml_withheld else (
+                "<body>"
+                f"<sec><title>Introduction</title><p>Introduction of {pmcid}.</p></sec>"
+                f"<sec><title>Methods</title><p>Methods of {pmcid}.</p>"
+                f"<sec><title>Cell culture</title><p>Cells of {pmcid}.</p></sec></sec>"
+                "</body>"
+            )
+            articles.append(
+                '<article article-type="research-article"><front><article-meta>'
+                f'<article-id pub-id-type="pmc">{numeric}</article-id>'
+                f"<title-group><article-title>Article {pmcid}</article-title></title-group>"
+                f"<abstract><p>Abstract of {pmcid}.</p></abstract>"
+                f"</article-meta></front>{body}</article>"
+            )
+        return '<?xml version="1.0" ?><pmc-articleset>' + "".join(articles) + "</pmc-articleset>"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                with server._lock:
+                    server.requests.append(self.path)
+                    failure = server._failures.pop(0) if server._failures else None
+
+                if failure:
+                    status, retry_after = failure
+                    headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+                    self._send(status, b"rate limited", "text/plain", headers)
+                    return
+
+                if parsed.path == IDCONV_PATH:
+                    ids = parse_qs(parsed.query).get("ids", [""])[0]
+                    body = json.dumps(server.idconv([i for i in ids.split(",") if i])).encode("utf-8")
+                    self._send(200, body, "application/json")
+                    return
+
+                if parsed.path == EUTILS_PATH + "efetch.fcgi":
+                    ids = parse_qs(parsed.query).get("id", [""])[0]
+                    body = server.efetch_pmc([i for i in ids.split(",") if i]).encode("utf-8")
+                    self._send(200, body, "text/xml")
+                    return
+
+                pmid = parsed.path.strip("/")
+                if pmid.isdigit():
+                    self._send(200, server.pubmed_page(pmid).encode("utf-8"), "text/html")
+                    return
+                self._send(404, b"not found", "text/plain")
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local NCBI mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--records", help="JSON 文件：{pmid: pmcid 或 null}")
+    args = parser.parse_args()
+
+    records = {}
+    if args.records:
+        with open(args.records, "r", encoding="utf-8") as f:
+            records = json.load(f)
+    server = MockNCBIServer(records, host=args.host, port=args.port)
+    print(f"[MockNCBI] {server.url}（ID 转换: {server.idconv_url}，E-utilities: {server.eutils_url}）")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
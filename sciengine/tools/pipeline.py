@@ -0,0 +1,184 @@
+# sciengine/tools/pipeline.py
+"""
+线程版流式流水线。
+每个阶段有自己的 worker 数，阶段之间用有界队列连接：
+    输入 → [stage 1 × n1] → queue → [stage 2 × n2] → queue → ... → 输出
+- 下游处理慢时队列写满，上游自动阻塞（背压），内存有上限
+- 网络阶段（解析 / 下载）与计算阶段（编码）同时运行：第 1 篇在编码时第 10 篇还在下载
+- 阶段函数返回 None 表示丢弃该条目（如下载失败 / 已入库）
+- fan_out=True 的阶段返回可迭代对象，其中每个元素分别送往下游（如一次批量请求下载多篇论文）
+- flush：阶段最后一个 worker 退出时调用一次，返回的元素送往下游（攒批阶段输出剩余的不满一批的部分）
+- 统计每个阶段的处理数 / 丢弃数 / 异常数 / 忙碌时间 / 吞吐，以及各输入队列的平均与最大深度
+"""
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, fan_out: bool = False,
+                 flush: Optional[Callable[[], Iterable[Any]]] = None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.fan_out = fan_out
+        self.flush = flush
+
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _record(self, start: float, end: float, outcome: str):
+        with self._lock:
+            self.busy_seconds += end - start
+            self.first_start = start if self.first_start is None else min(self.first_start, start)
+            self.last_end = end if self.last_end is None else max(self.last_end, end)
+            if outcome == "ok":
+                self.processed += 1
+            elif outcome == "dropped":
+                self.dropped += 1
+            else:
+                self.errors += 1
+
+    def stats(self) -> Dict[str, float]:
+        active = (self.last_end - self.first_start) if self.first_start is not None else 0.0
+        handled = self.processed + self.dropped + self.errors
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "busy_seconds": self.busy_seconds,
+            "items_per_second": handled / active if active > 0 else 0.0,
+        }
+
+
+class StreamingPipeline:
+    def __init__(self, stages: List[Stage], queue_size: int = 16, report_interval: float = 10.0):
+        """
+        queue_size: 阶段之间每个队列的容量
+        report_interval: 运行中打印队列深度的间隔（秒），<= 0 时不打印
+        """
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.report_interval = report_interval
+        self.queues: List[queue.Queue] = []
+        self._depth_samples: List[List[int]] = []
+        self.elapsed = 0.0
+
+    def run(self, items: Iterable[Any]) -> List[Any]:
+        """处理全部输入，返回最后一个阶段的输出（完成顺序）"""
+        self.queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self._depth_samples = [[] for _ in self.stages]
+        outputs: List[Any] = []
+        outputs_lock = threading.Lock()
+        start = time.perf_counter()
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for w in range(stage.workers):
+                t = threading.Thread(
+                    target=self._worker, name=f"{stage.name}-{w}",
+                    args=(i, remaining, outputs, outputs_lock), daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        stop = threading.Event()
+        monitor = threading.Thread(target=self._monitor, args=(stop,), daemon=True)
+        monitor.start()
+
+        for item in items:
+            self.queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            self.queues[0].put(_DONE)
+
+        for t in threads:
+            t.join()
+        stop.set()
+        monitor.join()
+
+        self.elapsed = time.perf_counter() - start
+        self.report()
+        return outputs
+
+    def _worker(self, index: int, remaining: List[int], outputs: List[Any], outputs_lock: threading.Lock):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            t0 = time.perf_counter()
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                stage._record(t0, time.perf_counter(), "error")
+                print(f"[Pipeline] {stage.name} 失败: {e}")
+                continue
+            stage._record(t0, time.perf_counter(), "dropped" if result is None else "ok")
+            if result is None:
+                continue
+            self._emit(result if stage.fan_out else (result,), outbox, outputs, outputs_lock)
+
+        # 本阶段最后一个退出的 worker 输出 flush 结果并通知下游结束
+        with stage._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and stage.flush is not None:
+            try:
+                self._emit(stage.flush() or (), outbox, outputs, outputs_lock)
+            except Exception as e:
+                stage.errors += 1
+                print(f"[Pipeline] {stage.name} flush 失败: {e}")
+        if last and outbox is not None:
+            for _ in range(self.stages[index + 1].workers):
+                outbox.put(_DONE)
+
+    @staticmethod
+    def _emit(results: Iterable[Any], outbox: Optional[queue.Queue], outputs: List[Any],
+              outputs_lock: threading.Lock):
+        for out in results:
+            if out is None:
+                continue
+            if outbox is not None:
+                outbox.put(out)  # 下游队列满时阻塞
+            else:
+                with outputs_lock:
+                    outputs.append(out)
+
+    def _monitor(self, stop: threading.Event):
+        last_report = time.perf_counter()
+        while not stop.wait(0.2):
+            for samples, q in zip(self._depth_samples, self.queues):
+                samples.append(q.qsize())
+            if self.report_interval > 0 and time.perf_counter() - last_report >= self.report_interval:
+                last_report = time.perf_counter()
+                depths = ", ".join(f"{s.name}={q.qsize()}" for s, q in zip(self.stages, self.queues))
+                print(f"[Pipeline] 队列深度: {depths}")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for stage, samples in zip(self.stages, self._depth_samples):
+            result[stage.name] = {
+                **stage.stats(),
+                "queue_avg": sum(samples) / len(samples) if samples else 0.0,
+                "queue_max": max(samples) if samples else 0,
+            }
+        return result
+
+    def report(self):
+        print(f"[Pipeline] 完成，总耗时 {self.elapsed:.2f}s")
+        for name, s in self.stats().items():
+            print(f"  {name:<10} workers={s['workers']} 处理 {s['processed']} / 丢弃 {s['dropped']} / "
+                  f"异常 {s['errors']}，{s['items_per_second']:.2f} 条/s，忙碌 {s['busy_seconds']:.2f}s，"
+                  f"输入队列 平均 {s['queue_avg']:.1f} / 最大 {s['queue_max']}")
@@ -0,0 +1,188 @@
+# sciengine/tools/pmc_fulltext.py
+"""
+PMC 全文（JATS XML）批量获取与流式解析。
+替代 “下载渲染后的 PMC HTML 页面 + trafilatura.extract”：
+- 一次 efetch(db=pmc) 请求取多篇文章的 XML（SCI_PMC_EFETCH_BATCH，默认 20 篇 / 请求），
+  走共享 HTTP 层（连接池 / 限速）；每篇文章的 XML 按单个 PMCID 缓存（与单篇 efetch 请求同一个键），
+  只有未命中的 PMCID 排序后分批请求，相关主题的查询之间可以复用已下载的全文
+- iterparse 流式解析，每解析完一篇 <article> 就释放其子树，内存不随批大小增长
+- 按 <sec> 拆成章节：{"title": "Methods > Cell culture", "text": 段落以空行分隔}，摘要作为第一个章节
+- 出版方不允许下载 XML 全文（无 <body>）的文章不返回，由调用方走 HTML 兜底
+接口根地址可用 NCBI_EUTILS_URL 覆盖（指向本地 mock_ncbi 服务做测试）
+"""
+import io
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from sciengine.tools.http_cache import cache_lookup, cache_store
+from sciengine.tools.http_client import http_get
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+EFETCH_BATCH_SIZE = int(os.getenv("SCI_PMC_EFETCH_BATCH", 20))
+
+
+def normalize_pmcid(value: Optional[str]) -> Optional[str]:
+    """'PMC123' / '123' / PMC 文章链接 → 'PMC123'；只有纯数字才视为不带前缀的 id"""
+    text = str(value or "").strip()
+    match = re.search(r"PMC(\d+)", text, re.IGNORECASE)
+    if match:
+        return f"PMC{match.group(1)}"
+    return f"PMC{text}" if text.isdigit() else None
+
+
+def _tag(elem: ET.Element) -> str:
+    return elem.tag.rsplit("}", 1)[-1] if isinstance(elem.tag, str) else ""
+
+
+def _text(elem: Optional[ET.Element]) -> str:
+    if elem is None:
+        return ""
+    return re.sub(r"\s+", " ", "".join(elem.itertext())).strip()
+
+
+def _children(elem: ET.Element, name: str) -> List[ET.Element]:
+    return [child for child in elem if _tag(child) == name]
+
+
+def _find(elem: ET.Element, path: Iterable[str]) -> Optional[ET.Element]:
+    for name in path:
+        found = _children(elem, name)
+        if not found:
+            return None
+        elem = found[0]
+    return elem
+
+
+def _sections(elem: ET.Element, heading: str = "") -> List[Dict[str, str]]:
+    """elem 下直属段落成一节，子 <sec> 递归，标题用 “父 > 子” 路径"""
+    sections = []
+    paragraphs = [_text(p) for p in _children(elem, "p")]
+    paragraphs = [p for p in paragraphs if p]
+    if paragraphs:
+        sections.append({"title": heading, "text": "\n\n".join(paragraphs)})
+    for sec in _children(elem, "sec"):
+        title = _text(_find(sec, ["title"]))
+        path = f"{heading} > {title}" if heading and title else (title or heading)
+        sections.extend(_sections(sec, path))
+    return sections
+
+
+def article_pmcid(article: ET.Element) -> Optional[str]:
+    """<article-meta> 中的 PMCID（无正文的文章也有）"""
+    meta = _find(article, ["front", "article-meta"])
+    for article_id in _children(meta, "article-id") if meta is not None else []:
+        if article_id.get("pub-id-type") in ("pmc", "pmcid", "pmcaid"):
+            pmcid = normalize_pmcid(article_id.text)
+            if pmcid:
+                return pmcid
+    return None
+
+
+def parse_article(article: ET.Element) -> Optional[Dict[str, Any]]:
+    """一篇 JATS <article> → {"pmcid", "title", "sections"}；没有正文时返回 None"""
+    meta = _find(article, ["front", "article-meta"])
+    if meta is None:
+        return None
+
+    pmcid = article_pmcid(article)
+    body = _find(article, ["body"])
+    body_sections = _sections(body, "") if body is not None else []
+    if not pmcid or not body_sections:
+        return None
+
+    sections = []
+    abstract = _find(meta, ["abstract"])
+    if abstract is not None:
+        abstract_text = "\n\n".join(s["text"] for s in _sections(abstract, "Abstract"))
+        if abstract_text:
+            sections.append({"title": "Abstract", "text": abstract_text})
+    sections.extend({"title": s["title"] or "Body", "text": s["text"]} for s in body_sections)
+
+    return {
+        "pmcid": pmcid,
+        "title": _text(_find(meta, ["title-group", "article-title"])) or None,
+        "sections": sections,
+    }
+
+
+def iter_articles(xml_bytes: bytes):
+    """流式解析 <pmc-articleset>，逐篇产出 parse_article 的结果（跳过无正文的文章）"""
+    for elem in iter_article_elements(xml_bytes):
+        parsed = parse_article(elem)
+        elem.clear()
+        if parsed:
+            yield parsed
+
+
+def iter_article_elements(xml_bytes: bytes):
+    """流式产出最外层 <article> 元素（子树完整）；调用方用完后 clear 释放"""
+    depth = 0
+    for event, elem in ET.iterparse(io.BytesIO(xml_bytes), events=("start", "end")):
+        if _tag(elem) != "article":
+            continue
+        # 只处理最外层 <article>（sub-article / response 嵌套在其中）
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            yield elem
+
+
+def _single_params(pmcid: str) -> Dict[str, Any]:
+    """单篇 efetch 请求的参数，作为每篇文章的缓存键"""
+    return {"db": "pmc", "id": pmcid[3:], "retmode": "xml"}
+
+
+def fetch_jats_batch(pmcids: List[str], batch_size: int = EFETCH_BATCH_SIZE) -> Dict[str, Dict[str, Any]]:
+    """
+    批量取 PMC 全文 XML 并解析，返回 {"PMC123": {"pmcid", "title", "sections"}}；
+    请求失败的批次与无 XML 正文的文章不在结果中
+    """
+    ids = {p for p in (normalize_pmcid(x) for x in pmcids) if p}
+    results: Dict[str, Dict[str, Any]] = {}
+    url = os.getenv("NCBI_EUTILS_URL", EUTILS_URL).rstrip("/") + "/efetch.fcgi"
+
+    pending = []
+    for pmcid in sorted(ids, key=lambda p: (len(p), p)):
+        cached = cache_lookup(url, _single_params(pmcid))
+        if cached is None:
+            pending.append(pmcid)
+            continue
+        for article in iter_articles(cached.content):
+            results[article["pmcid"]] = article
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        params = {
+            "db": "pmc",
+            "id": ",".join(p[3:] for p in batch),
+            "retmode": "xml",
+            "api_key": os.environ.get("NCBI_API_KEY"),
+        }
+        try:
+            response = http_get(url, params=params, timeout=60, cache=False)
+            response.raise_for_status()
+            for elem in iter_article_elements(response.content):
+                pmcid = article_pmcid(elem)
+                if pmcid in ids:
+                    # 无正文的文章也缓存，下次直接走 HTML 兜底，不再请求 efetch
+                    cache_store(url, _single_params(pmcid),
+                                b"<pmc-articleset>" + ET.tostring(elem) + b"</pmc-articleset>", "text/xml")
+                parsed = parse_article(elem)
+                elem.clear()
+                if parsed:
+                    results[parsed["pmcid"]] = parsed
+        except (httpx.HTTPError, ET.ParseError) as e:
+            print(f"[PMC-XML] 批量获取失败（{len(batch)} 篇），改用 HTML: {e}")
+    print(f"[PMC-XML] {len(results)}/{len(ids)} 篇获取到 XML 全文")
+    return results
+
+
+def sections_to_text(sections: List[Dict[str, str]]) -> str:
+    """章节拼成纯文本（标题单独一行，章节之间空行），兼容只用 content 的下游"""
+    return "\n\n".join(f"{s['title']}\n{s['text']}" for s in sections)
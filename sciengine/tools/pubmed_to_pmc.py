@@ -1,11 +1,121 @@
 ## sciengine/pubmed_to_pmc.py
 """
 从search agent的results中，pubmed_url -> pmcid_url
+- resolve_pubmed_urls / lookup_pmcids: 批量解析（推荐）。从 URL 中取 PMID，调用 NCBI ID 转换接口，
+  每个请求最多 200 个 PMID，100 篇论文只需一次请求
+- extract_pmc_link_from_pubmed: 逐篇抓取 PubMed 页面解析（兜底：URL 中没有 PMID 或批量请求失败时使用）
+接口地址可用 NCBI_IDCONV_URL 覆盖（指向本地 mock_ncbi 服务做测试）
 """
 
-import requests
+import json
+import os
+import httpx
 from bs4 import BeautifulSoup
 import re
+from typing import Dict, List, Optional
+
+from sciengine.tools.http_cache import cache_lookup, cache_store
+from sciengine.tools.http_client import http_get
+
+IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+IDCONV_BATCH_SIZE = 200  # 接口单次上限
+PMC_ARTICLE_URL = "https://pmc.ncbi.nlm.nih.gov/articles/{pmcid}/"
+
+
+def pmid_from_url(pubmed_url: str) -> Optional[str]:
+    match = re.search(r'/(\d+)/?(?:[?#].*)?$', pubmed_url or "")
+    return match.group(1) if match else None
+
+
+def batch_pmid_to_pmcid(pmids: List[str], batch_size: int = IDCONV_BATCH_SIZE,
+                        timeout: float = 30) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    批量 PMID → PMCID。返回 {pmid: {"pmcid", "doi"}}，PMC 中没有的文章 pmcid 为 None；
+    结果按单个 PMID 缓存，只有未命中的 PMID 排序后分批请求（批次与输入顺序无关）；
+    请求失败抛出 httpx.HTTPError，由调用方决定是否兜底
+    """
+    mapping: Dict[str, Dict[str, Optional[str]]] = {}
+    url = os.getenv("NCBI_IDCONV_URL", IDCONV_URL)
+    base_params = {
+        "idtype": "pmid",
+        "format": "json",
+        "tool": "sciengine",
+        "email": os.environ.get("NCBI_EMAIL", ""),
+        "api_key": os.environ.get("NCBI_API_KEY"),
+    }
+
+    def add_records(records, store: bool):
+        for record in records:
+            pmid = str(record.get("pmid", "")).strip()
+            if not pmid:
+                continue
+            mapping[pmid] = {
+                "pmcid": record.get("pmcid") if record.get("status") != "error" else None,
+                "doi": record.get("doi"),
+            }
+            if store:
+                cache_store(url, {**base_params, "ids": pmid},
+                            json.dumps({"records": [record]}).encode("utf-8"), "application/json")
+
+    pending = []
+    for pmid in sorted({str(p) for p in pmids if p}, key=lambda p: (len(p), p)):
+        cached = cache_lookup(url, {**base_params, "ids": pmid})
+        if cached is None:
+            pending.append(pmid)
+        else:
+            add_records(cached.json().get("records", []), store=False)
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        response = http_get(url, params={**base_params, "ids": ",".join(chunk)}, timeout=timeout, cache=False)
+        response.raise_for_status()
+        add_records(response.json().get("records", []), store=True)
+    return mapping
+
+
+def lookup_pmcids(pubmed_urls: List[str]) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    一批 PubMed URL 的批量 ID 转换结果 {pubmed_url: {"pmcid", "doi"}}；
+    请求失败时返回空 dict（全部交给 resolve_one 兜底）
+    """
+    pmids = {url: pmid_from_url(url) for url in pubmed_urls}
+    try:
+        mapping = batch_pmid_to_pmcid([p for p in pmids.values() if p])
+    except Exception as e:
+        print(f"[IDConv] 批量解析失败，改为逐篇抓取页面: {e}")
+        return {}
+    print(f"[IDConv] 批量解析 {len(mapping)}/{len(pubmed_urls)} 条 PMID")
+    return {url: mapping[pmid] for url, pmid in pmids.items() if pmid in mapping}
+
+
+def resolve_one(pubmed_url: str, record: Optional[Dict[str, Optional[str]]] = None,
+                title: Optional[str] = None) -> Optional[dict]:
+    """
+    用批量接口的结果（含 “不在 PMC 中”）组装解析结果；没有结果时抓取 PubMed 页面兜底
+    返回结构与 extract_pmc_link_from_pubmed 相同
+    """
+    if record is None:
+        return extract_pmc_link_from_pubmed(pubmed_url)
+    pmcid = record.get("pmcid")
+    return {
+        'pubmed_url': pubmed_url,
+        'pmc_url': PMC_ARTICLE_URL.format(pmcid=pmcid) if pmcid else None,
+        'pmcid': pmcid,
+        'pmid': pmid_from_url(pubmed_url),
+        'title': title,
+        'doi': record.get("doi"),
+    }
+
+
+def resolve_pubmed_urls(pubmed_urls: List[str],
+                        titles: Optional[Dict[str, str]] = None) -> Dict[str, Optional[dict]]:
+    """
+    批量解析 PubMed URL，返回 {pubmed_url: 解析结果}
+    titles: 可选 {pubmed_url: 标题}（ID 转换接口不返回标题，可用检索结果补上）
+    """
+    titles = titles or {}
+    records = lookup_pmcids(pubmed_urls)
+    return {url: resolve_one(url, records.get(url), titles.get(url)) for url in pubmed_urls}
 
 
 def extract_pmc_link_from_pubmed(pubmed_url):
@@ -24,7 +134,7 @@ def extract_pmc_link_from_pubmed(pubmed_url):
 
     try:
         print(f"正在访问 PubMed 页面: {pubmed_url}")
-        response = requests.get(pubmed_url, headers=headers, timeout=30)
+        response = http_get(pubmed_url, headers=headers, timeout=30)
         response.raise_for_status()
 
         soup = BeautifulSoup(response.content, 'html.parser')
@@ -90,7 +200,7 @@ def extract_pmc_link_from_pubmed(pubmed_url):
 
         return result
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"请求错误: {e}")
         return None
     except Exception as e:
@@ -0,0 +1,160 @@
+# sciengine/tools/rate_limiter.py
+"""
+NCBI 请求限速（令牌桶），线程 / 协程 / 进程之间共享。
+NCBI 规定 E-utilities 每秒最多 3 个请求，设置 NCBI_API_KEY 后每秒 10 个；
+search 节点并发的多个 agent、RAG 流水线的下载 worker 都经 http_client 走同一个令牌桶，
+吞吐稳定在上限附近，而不是打满后收到一片 429。
+- 桶状态（令牌数 / 上次补充时间 / 暂停截止时间）存放在本地文件中，用 flock 互斥，
+  同一台机器上的多个 worker 进程共享同一个桶（SCI_RATE_LIMIT_DIR，默认系统临时目录）
+- 收到 429 / Retry-After 时调用 penalize，所有进程一起暂停到截止时间
+- 限速分组：eutils（E-utilities + ID 转换接口），web（PubMed / PMC 页面）
+  速率可用 SCI_NCBI_RATE / SCI_NCBI_WEB_RATE 覆盖
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:  # Windows：退化为进程内限速
+    fcntl = None
+
+RATE_WITHOUT_KEY = 3.0
+RATE_WITH_KEY = 10.0
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, capacity: Optional[float] = None,
+                 state_dir: Optional[str] = None):
+        """
+        rate: 每秒补充的令牌数；capacity: 桶容量（允许的突发），默认等于 rate
+        """
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        state_dir = state_dir or os.getenv("SCI_RATE_LIMIT_DIR") or tempfile.gettempdir()
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, f"sciengine_ratelimit_{name}.json")
+        self._lock = threading.Lock()
+
+    # =====================================================================
+    # 共享状态
+    # =====================================================================
+    def _update(self, fn):
+        """在文件锁内读取状态 → fn(state, now) 修改 → 写回，返回 fn 的返回值"""
+        with self._lock, open(self.path, "a+", encoding="utf-8") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    state = {}
+                now = time.time()
+                state.setdefault("tokens", self.capacity)
+                state.setdefault("updated", now)
+                state.setdefault("blocked_until", 0.0)
+                result = fn(state, now)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return result
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _try_acquire(self) -> float:
+        """拿到令牌返回 0，否则返回建议等待的秒数"""
+        def take(state, now):
+            if now < state["blocked_until"]:
+                return state["blocked_until"] - now
+            elapsed = max(0.0, now - state["updated"])
+            state["tokens"] = min(self.capacity, state["tokens"] + elapsed * self.rate)
+            state["updated"] = now
+            if state["tokens"] >= 1.0:
+                state["tokens"] -= 1.0
+                return 0.0
+            return (1.0 - state["tokens"]) / self.rate
+        return self._update(take)
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """协程版：文件锁操作放到线程里，等待用 asyncio.sleep，不阻塞事件循环"""
+        while True:
+            wait = await asyncio.to_thread(self._try_acquire)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """服务端要求退避（429 / Retry-After）：所有共享此桶的进程暂停 seconds 秒，并清空令牌"""
+        def block(state, now):
+            state["blocked_until"] = max(state["blocked_until"], now + seconds)
+            state["tokens"] = 0.0
+            state["updated"] = now + seconds
+        self._update(block)
+
+
+# =====================================================================
+# 按 URL 选择令牌桶
+# =====================================================================
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket_config(url: str) -> Optional[Tuple[str, float]]:
+    host = urlsplit(url).hostname or ""
+    if not (host == "ncbi.nlm.nih.gov" or host.endswith(".ncbi.nlm.nih.gov")):
+        return None
+    api_key = os.environ.get("NCBI_API_KEY")
+    default_rate = RATE_WITH_KEY if api_key else RATE_WITHOUT_KEY
+    # 同一个 key（或都没有 key）的进程共享同一个桶
+    suffix = hashlib.sha1((api_key or "nokey").encode("utf-8")).hexdigest()[:8]
+    path = urlsplit(url).path
+    if host.startswith("eutils.") or "/utils/idconv/" in path:
+        return f"eutils_{suffix}", float(os.getenv("SCI_NCBI_RATE", default_rate))
+    return f"web_{suffix}", float(os.getenv("SCI_NCBI_WEB_RATE", default_rate))
+
+
+def limiter_for_url(url: str) -> Optional[TokenBucket]:
+    """NCBI 域名返回对应的令牌桶，其他域名不限速返回 None"""
+    config = _bucket_config(url)
+    if config is None:
+        return None
+    name, rate = config
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None or bucket.rate != rate:
+            bucket = _buckets[name] = TokenBucket(name, rate)
+        return bucket
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After 可以是秒数或 HTTP 日期"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
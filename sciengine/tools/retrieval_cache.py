@@ -0,0 +1,68 @@
+# sciengine/tools/retrieval_cache.py
+"""
+检索结果缓存。
+strongest_retrieve 的结果只取决于 query、检索参数和向量库内容：同一大纲重跑、LLM 失败重试、
+不同小节重复的问题都会重复做混合召回 → MMR → 精排。
+这里按 (向量库路径, 语料指纹, 归一化 query, 检索参数) 缓存最终结果：
+- 只存 chunk id 与精排分数，Document 命中时从语料快照重建，内存占用很小
+- 条目数有上限（LRU），每条有 TTL
+- 语料有写入时指纹变化，旧条目自然失效
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sciengine.tools.score_cache import normalize_query
+
+# [(chunk_id, rerank_score 或 None), ...]
+CachedHits = List[Tuple[str, Optional[float]]]
+
+
+class RetrievalCache:
+    def __init__(self, max_entries: int = 4096, ttl: float = 3600.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Any, Tuple[float, CachedHits]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(scope: Any, query: str, params: Tuple) -> Any:
+        """scope: 向量库路径 + 语料指纹；params: fetch_k / mmr_k / mmr_lambda / top_n"""
+        return scope, normalize_query(query), params
+
+    def get(self, key: Any) -> Optional[CachedHits]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Any, hits: CachedHits):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), list(hits))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
@@ -1,23 +1,70 @@
 # sciengine/sci_embedding.py
 """
 RAG的嵌入模块。
-PubMed_url → Pmcid_url → 全文 → 切块 → 向量库
+PubMed_url → Pmcid_url → 全文（PMC JATS XML，按章节；取不到时 HTML + trafilatura 兜底）→ 切块 → 向量库
 embedding model: bioembedding
-vector database: chroma
-[单线程，将全文顺序嵌入向量数据库]
+vector database: chroma（或 flat，见 vector_store.open_vector_store）
+[run_RAG 为流式流水线（见 pipeline.py）；create_VDB_* 单线程切块，chunk 攒批后批量写入向量数据库（见 bulk_writer.py）]
 """
 import os
 import json
-from typing import List, Dict, Any
-import trafilatura
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from sciengine.tools.pubmed_to_pmc import extract_pmc_link_from_pubmed
-from sciengine.model.bioembedding_model import BioBERTEmbeddings
+from sciengine.tools.vector_store import open_vector_store
+from sciengine.tools.pubmed_to_pmc import lookup_pmcids, resolve_one, resolve_pubmed_urls
+from sciengine.model.registry import get_embedding_model
+from sciengine.tools.bm25_index import BM25Index
+from sciengine.tools.bulk_writer import BulkIndexWriter, SOURCE_ABSTRACT, SOURCE_FULLTEXT
+from sciengine.tools.pipeline import StreamingPipeline, Stage
+from sciengine.tools.http_client import fetch_text
+from sciengine.tools.pmc_fulltext import EFETCH_BATCH_SIZE, fetch_jats_batch, normalize_pmcid, sections_to_text
 from sciengine.model.llm_models import get_chat_model
 from sciengine.agent.overallstate import OverallState
 
 
+def extract_pubmed_titles(search_results: List[Dict[str, Any]]) -> Dict[str, str]:
+    """{pubmed_url: 标题}，补全 ID 转换接口不返回的标题"""
+    titles = {}
+    for task in search_results:
+        result = task.get("result") if isinstance(task, dict) else None
+        papers = result.get("papers") if isinstance(result, dict) else None
+        for paper in papers or []:
+            if isinstance(paper, dict) and paper.get("url") and paper.get("title"):
+                titles.setdefault(paper["url"], paper["title"])
+    return titles
+
+
+def paper_key(paper: Dict[str, Any]) -> Optional[str]:
+    """
+    论文的稳定标识：规范化的 PMCID（'PMC123'，PMC 链接 / 裸 id 归一到同一个 key）> pubmed_url > title
+    > 全文内容哈希；都没有时返回 None（不入库）
+    """
+    key = (normalize_pmcid(paper.get("pmcid")) or paper.get("pmcid")
+           or paper.get("pubmed_url") or paper.get("title"))
+    if key:
+        return key
+    content = paper.get("content")
+    if isinstance(content, str) and content.strip():
+        return "sha1:" + hashlib.sha1(content.encode("utf-8")).hexdigest()
+    return None
+
+
+def make_chunk_ids(key: str, chunks: List[str]) -> List[str]:
+    """
+    确定性 chunk id = sha1(论文标识, chunk 序号, chunk 文本哈希)；
+    同一篇论文重复入库得到相同的 id，向量库 / BM25 按 id upsert，不会重复写入
+    """
+    if not key:
+        raise ValueError("make_chunk_ids 需要非空的论文标识")
+    ids = []
+    for offset, chunk in enumerate(chunks):
+        text_hash = hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+        ids.append(hashlib.sha1(f"{key}\x1f{offset}\x1f{text_hash}".encode("utf-8")).hexdigest())
+    return ids
+
+
 class Pubmed_RAG:
     """
     - PubMed → PMC 解析
@@ -28,7 +75,7 @@ class Pubmed_RAG:
     """
 
     def __init__(self):
-        self.embedding = BioBERTEmbeddings()
+        self.embedding = get_embedding_model()
         self.llm = get_chat_model()
         self.persist_directory = "./chroma_papers"
 
@@ -71,7 +118,7 @@ class Pubmed_RAG:
                 continue
 
         # 去重
-        urls = list(set(urls))
+        urls = list(dict.fromkeys(urls))
 
         print(f"✅ 共提取到 {len(urls)} 条 PubMed 链接")
         return urls
@@ -79,17 +126,14 @@ class Pubmed_RAG:
     # =====================================================================
     # ① PubMed → PMC
     # =====================================================================
-    def batch_get_pmcid(self, urls: List[str]) -> List[Dict[str, Any]]:
+    def batch_get_pmcid(self, urls: List[str], titles: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """批量 ID 转换（一次请求最多 200 篇），失败的逐篇抓取 PubMed 页面兜底"""
         results = []
-        for url in urls:
-            try:
-                res = extract_pmc_link_from_pubmed(url)
-                if res:
-                    results.append(res)
-                else:
-                    print(f"[WARN] 无法解析 {url}")
-            except Exception as e:
-                print(f"[ERROR] {url}: {e}")
+        for url, res in resolve_pubmed_urls(urls, titles).items():
+            if res:
+                results.append(res)
+            else:
+                print(f"[WARN] 无法解析 {url}")
         return results
 
     # =====================================================================
@@ -97,33 +141,146 @@ class Pubmed_RAG:
     # =====================================================================
     def get_paper_content(self, pmcid_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         results = []
-        for item in pmcid_items:
-            pmc_url = item.get("pmc_url")
-            print(f"Downloading: {pmc_url}")
-
-            downloaded = trafilatura.fetch_url(pmc_url)
-            text = trafilatura.extract(downloaded) if downloaded else None
+        for start in range(0, len(pmcid_items), EFETCH_BATCH_SIZE):
+            results.extend(self._download_batch(pmcid_items[start:start + EFETCH_BATCH_SIZE]))
+        self._save_paper_content(results)
+        return results
 
+    def _download_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """一次 efetch 取一批文章的 JATS XML（带章节）；没有 XML 正文的逐篇下载 HTML 兜底"""
+        pmcids = [normalize_pmcid(item.get("pmcid") or item.get("pmc_url")) if item.get("pmc_url") else None
+                  for item in items]
+        articles = fetch_jats_batch([p for p in pmcids if p])
+        results = []
+        for item, pmcid in zip(items, pmcids):
+            article = articles.get(pmcid) if pmcid else None
+            if article is None:
+                results.append(self._download_one(item))
+                continue
             results.append({
                 "pubmed_url": item.get("pubmed_url"),
-                "pmcid": pmc_url,
-                "title": item.get("title"),
-                "content": text
+                "pmcid": item.get("pmc_url"),
+                "title": item.get("title") or article["title"],
+                "content": sections_to_text(article["sections"]),
+                "sections": article["sections"],
             })
+        return results
 
+    def _download_one(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        pmc_url = item.get("pmc_url")
+        text = None
+        # 不在 PMC 中的文章没有全文链接，后续用 abstract
+        if pmc_url:
+            print(f"Downloading: {pmc_url}")
+            downloaded = fetch_text(pmc_url)
+            if downloaded:
+                import trafilatura  # 延迟导入：只有 XML 全文取不到时才需要
+                text = trafilatura.extract(downloaded)
+
+        return {
+            "pubmed_url": item.get("pubmed_url"),
+            "pmcid": pmc_url,
+            "title": item.get("title"),
+            "content": text
+        }
+
+    @staticmethod
+    def _save_paper_content(results: List[Dict[str, Any]]):
         # 保存到 json（可选）
         with open("paper_content.json", "w", encoding="utf-8") as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
 
-        return results
+    # =====================================================================
+    # 切块
+    # =====================================================================
+    @staticmethod
+    def _paragraph_splitter() -> RecursiveCharacterTextSplitter:
+        # BERT chunk 建议 <= 300 字符。使用递归切块，优先按段落切分。
+        # separators 顺序：双换行符 (段落)、单换行符、空格、字符
+        return RecursiveCharacterTextSplitter(
+            separators=["\n\n", "\n", " ", ""],
+            chunk_size=300,
+            chunk_overlap=50
+        )
+
+    @staticmethod
+    def _find_abstract(paper: Dict[str, Any], state: OverallState) -> Optional[str]:
+        """从 search_results 中查找对应的 abstract（优先用 pubmed_url 匹配，其次标题）"""
+        pubmed_url = paper.get("pubmed_url")
+        title = paper.get("title")
+        for task in state["search_results"]:
+            for p in task["result"].get("papers", []):
+                if (pubmed_url and p.get("url") == pubmed_url) or p.get("title") == title:
+                    if p.get("abstract"):
+                        return p["abstract"]
+                    break
+        return None
+
+    def _chunk_paper(self, paper: Dict[str, Any], splitter: RecursiveCharacterTextSplitter,
+                     state: OverallState, writer: BulkIndexWriter):
+        """
+        切分一篇论文（无全文时用 abstract），返回 (paper_key, chunks, metas)；
+        有章节（JATS XML）时逐章节切分，chunk 不跨章节，metadata 带 section；
+        metadata 的 source 记录内容来源，只有摘要入库的论文拿到全文后会重新入库；
+        已入库 / 无标识 / 无内容 / 切片为空时返回 None
+        """
+        content = paper.get("content")
+        title = paper.get("title")
+        has_fulltext = bool(paper.get("sections")) or (bool(content) and isinstance(content, str))
+        source = SOURCE_FULLTEXT if has_fulltext else SOURCE_ABSTRACT
+
+        key = paper_key(paper)
+        if key is None:
+            print("⚠️ 论文缺少 pmcid / pubmed_url / title，跳过")
+            return None
+        if writer.is_indexed(key, source):
+            print(f"[跳过] 已在向量库中: {title}")
+            return None
+
+        print(f"📘 正在处理: {title}")
+
+        # (chunk, 所属章节)；非 XML 来源没有章节
+        pieces = []
+        if paper.get("sections"):
+            for section in paper["sections"]:
+                pieces.extend((c, section["title"]) for c in splitter.split_text(section["text"]))
+        elif not content or not isinstance(content, str):
+            print(f"{title} 无 content，使用 abstract")
+            abstract = self._find_abstract(paper, state)
+            if not abstract:
+                print(f"⚠️ 未找到 abstract，跳过")
+                return None
+            pieces = [(c, None) for c in splitter.split_text(abstract)]
+        else:
+            pieces = [(c, None) for c in splitter.split_text(content)]
+
+        if not pieces:
+            print("⚠️ 切片为空，跳过")
+            return None
+
+        chunks = [c for c, _ in pieces]
+        # metadata 对应每个 chunk
+        metas = []
+        for _, section in pieces:
+            meta = {
+                "pmcid": paper.get("pmcid"),
+                "title": paper.get("title"),
+                "pubmed_url": paper.get("pubmed_url"),
+                "paper_key": key,
+                "source": source
+            }
+            if section:
+                meta["section"] = section
+            metas.append(meta)
+        return key, chunks, metas
 
     # =====================================================================
     # ③ 创建向量数据库
     # =====================================================================
-    def create_VDB_fixed(self, papers):
+    def create_VDB_fixed(self, papers, build_index: bool = True):
         """
         从 paper_content.json 中读取内容，
-        每篇文章单独切片并写入向量库（在 for 循环内部添加 Chroma.from_texts）
+        每篇文章单独切片，chunk 跨论文攒批写入向量库；build_index 控制结束时是否构建 ANN 索引
         """
 
         # BERT chunk 建议 <= 300 字符
@@ -134,9 +291,13 @@ class Pubmed_RAG:
 
         # 创建向量库目录
         os.makedirs(self.persist_directory, exist_ok=True)
+        store = open_vector_store(self.persist_directory, embedding=self.embedding)
+        bm25_index = BM25Index.for_chroma_dir(self.persist_directory)
+        # 同一个向量库句柄批量写入；已入库的论文整篇跳过
+        writer = BulkIndexWriter(store, bm25_index, self.embedding)
 
         # ============================
-        # ✅ 遍历每篇文章 单独写入 Chroma
+        # ✅ 遍历每篇文章 切片后交给 writer 攒批写入
         # ============================
         for idx, paper in enumerate(papers):
             content = paper.get("content")
@@ -146,6 +307,11 @@ class Pubmed_RAG:
                 print(f"[跳过] 第 {idx + 1} 篇文章（无 content）")
                 continue
 
+            key = paper_key(paper)
+            if writer.is_indexed(key):
+                print(f"[跳过] 已在向量库中: {title}")
+                continue
+
             print(f"📘 正在处理: {title}")
 
             # 切片
@@ -160,119 +326,155 @@ class Pubmed_RAG:
                 {
                     "pmcid": paper.get("pmcid"),
                     "title": paper.get("title"),
-                    "pubmed_url": paper.get("pubmed_url")
+                    "pubmed_url": paper.get("pubmed_url"),
+                    "paper_key": key,
+                    "source": SOURCE_FULLTEXT
                 }
                 for _ in chunks
             ]
 
-            # ✅ 将 chunks 写入 Chroma（逐篇写入）
-            Chroma.from_texts(
-                texts=chunks,
-                metadatas=metas,
-                embedding=self.embedding,
-                persist_directory=self.persist_directory
-            )
+            # 按确定性 id 累积到写入批次（跨论文攒批编码 / upsert，BM25 同步写入）
+            writer.add_paper(key, make_chunk_ids(key, chunks), chunks, metas)
+            print(f"✅ 已切分 {len(chunks)} 个 chunk")
 
-            print(f"✅ 已写入 {len(chunks)} 个 chunk 到向量库")
-
-        print("🎉 向量库构建完成（逐篇写入模式）!")
+        writer.close(build_index=build_index)
+        print("🎉 向量库构建完成（批量写入模式）!")
 
     # =====================================================================
     # ③ 创建向量数据库 (已修改为优先按段落切块)
     # =====================================================================
-    def create_VDB_par(self, papers,state: OverallState):
+    def create_VDB_par(self, papers,state: OverallState, build_index: bool = True):
         """
         从 paper_content.json 中读取内容，
-        每篇文章单独切片并写入向量库。
+        每篇文章单独切片，chunk 跨论文攒批写入向量库（批大小 SCI_INDEX_BATCH_SIZE）。
 
         修改：使用 RecursiveCharacterTextSplitter，优先按段落分隔符切块。
         """
 
-        # BERT chunk 建议 <= 300 字符。使用递归切块，优先按段落切分。
-        # separators 顺序：双换行符 (段落)、单换行符、空格、字符
-        splitter = RecursiveCharacterTextSplitter(
-            separators=["\n\n", "\n", " ", ""],
-            chunk_size=300,
-            chunk_overlap=50
-        )
+        splitter = self._paragraph_splitter()
 
         # 创建向量库目录
         os.makedirs(self.persist_directory, exist_ok=True)
+        store = open_vector_store(self.persist_directory, embedding=self.embedding)
+        bm25_index = BM25Index.for_chroma_dir(self.persist_directory)
+        # 同一个向量库句柄批量写入；已入库的论文整篇跳过
+        writer = BulkIndexWriter(store, bm25_index, self.embedding)
 
         # ============================
-        # ✅ 遍历每篇文章 单独写入 Chroma
+        # ✅ 遍历每篇文章 切片后交给 writer 攒批写入
         # ============================
-        for idx, paper in enumerate(papers):
-            content = paper.get("content")
-            title = paper.get("title")
-            pubmed_url = paper.get("pubmed_url")  # 如果有 pubmed_url，最好用它匹配
-            pmcid = paper.get("pmcid")
-
-            print(f"📘 正在处理: {title}")
-
-            if not content or not isinstance(content, str):
-                print(f"第 {idx + 1} 篇文章无 content，使用 abstract")
-                # 从 search_results 中查找对应的 abstract
-                abstract = None
-                search_results = state["search_results"]
-                for task in search_results:
-                    for p in task["result"].get("papers", []):
-                        if pubmed_url and p.get("url") == pubmed_url:
-                            abstract = p.get("abstract")
-                            break
-                        elif p.get("title") == title:
-                            abstract = p.get("abstract")
-                            break
-                    if abstract:
-                        break
-
-                if not abstract:
-                    print(f"⚠️ 未找到 abstract，跳过")
-                    continue
-
-                chunks = splitter.split_text(abstract)
-            else:
-                chunks = splitter.split_text(content)
-
-            if not chunks:
-                print("⚠️ 切片为空，跳过")
-                continue
-
-            # metadata 对应每个 chunk
-            metas = [
-                {
-                    "pmcid": paper.get("pmcid"),
-                    "title": paper.get("title"),
-                    "pubmed_url": paper.get("pubmed_url")
-                }
-                for _ in chunks
-            ]
-
-            # 将 chunks 写入 Chroma（逐篇写入）
-            Chroma.from_texts(
-                texts=chunks,
-                metadatas=metas,
-                embedding=self.embedding,
-                persist_directory=self.persist_directory
-            )
-
-            print(f"✅ 已写入 {len(chunks)} 个 chunk 到向量库")
+        for paper in papers:
+            chunked = self._chunk_paper(paper, splitter, state, writer)
+            if chunked:
+                key, chunks, metas = chunked
+                # 按确定性 id 累积到写入批次（跨论文攒批编码 / upsert，BM25 同步写入）
+                writer.add_paper(key, make_chunk_ids(key, chunks), chunks, metas)
 
+        writer.close(build_index=build_index)
+        print(f"✅ BM25 索引已保存: {bm25_index.path}")
 
 
+    # =====================================================================
+    # 流式流水线：解析 → 下载 → 切块 → 编码 → 写库，各阶段并发重叠
+    # =====================================================================
     def run_RAG(self, state):
+        """
+        各阶段之间用有界队列连接（见 pipeline.py），网络等待与编码同时进行；
+        解析 / 下载按批（SCI_PMC_EFETCH_BATCH 篇）进行，一次 efetch 取一批全文 XML，下载阶段再把论文逐篇送往切块；
+        编码阶段跨论文攒批（SCI_EMBED_BATCH_SIZE 个 chunk 一次 embed_documents），写库阶段由 writer 攒批 upsert；
+        并发度：SCI_RESOLVE_WORKERS / SCI_DOWNLOAD_WORKERS / SCI_EMBED_WORKERS，
+        队列容量：SCI_PIPELINE_QUEUE_SIZE。结束时输出各阶段吞吐与队列深度
+        """
         pubmed_urls = self.extract_pubmed_urls_from_tasks(state["search_results"])
         print("已提取 pubmed 链接")
 
-        pmcid_urls = self.batch_get_pmcid(pubmed_urls)
-        print("已提取 pmcid 链接")
-
-        paper_content = self.get_paper_content(pmcid_urls)
-        print("已获取 paper content")
-
-        self.create_VDB_par(paper_content,state)
+        splitter = self._paragraph_splitter()
+        os.makedirs(self.persist_directory, exist_ok=True)
+        store = open_vector_store(self.persist_directory, embedding=self.embedding)
+        bm25_index = BM25Index.for_chroma_dir(self.persist_directory)
+        writer = BulkIndexWriter(store, bm25_index, self.embedding)
+
+        # 一次（或几次）批量 ID 转换；没有结果的 URL 在 resolve 阶段逐篇抓取页面兜底
+        records = lookup_pmcids(pubmed_urls)
+        titles = extract_pubmed_titles(state["search_results"])
+        downloaded: Dict[int, Dict[str, Any]] = {}
+
+        def resolve(batch):
+            resolved = []
+            for idx, url in batch:
+                res = resolve_one(url, records.get(url), titles.get(url))
+                if not res:
+                    print(f"[WARN] 无法解析 {url}")
+                    continue
+                resolved.append((idx, res))
+            return resolved or None
+
+        def download(batch):
+            papers = self._download_batch([item for _, item in batch])
+            for (idx, _), paper in zip(batch, papers):
+                downloaded[idx] = paper
+            return papers
+
+        def chunk(paper):
+            chunked = self._chunk_paper(paper, splitter, state, writer)
+            if not chunked:
+                return None
+            key, chunks, metas = chunked
+            return {"key": key, "ids": make_chunk_ids(key, chunks), "chunks": chunks, "metas": metas}
+
+        embed_batch_size = int(os.getenv("SCI_EMBED_BATCH_SIZE", 128))
+        embed_pending: List[Dict[str, Any]] = []
+        embed_lock = threading.Lock()
+
+        def embed_records(records):
+            # 多篇论文的 chunk 合并成一次编码，再按篇拆回
+            vectors = self.embedding.embed_documents([c for r in records for c in r["chunks"]])
+            offset = 0
+            for r in records:
+                r["embeddings"] = vectors[offset:offset + len(r["chunks"])]
+                offset += len(r["chunks"])
+            return records
+
+        def embed(record):
+            with embed_lock:
+                embed_pending.append(record)
+                if sum(len(r["chunks"]) for r in embed_pending) < embed_batch_size:
+                    return []
+                records = embed_pending[:]
+                embed_pending.clear()
+            return embed_records(records)
+
+        def flush_embed():
+            with embed_lock:
+                records = embed_pending[:]
+                embed_pending.clear()
+            return embed_records(records) if records else []
+
+        def index(record):
+            # 唯一的写入 worker，向量库 / BM25 只有一个写者
+            writer.add_embedded(record["key"], record["ids"], record["chunks"],
+                                record["metas"], record["embeddings"])
+            return record["key"]
+
+        pipeline = StreamingPipeline([
+            Stage("resolve", resolve, workers=int(os.getenv("SCI_RESOLVE_WORKERS", 4))),
+            Stage("download", download, workers=int(os.getenv("SCI_DOWNLOAD_WORKERS", 4)), fan_out=True),
+            Stage("chunk", chunk, workers=1),
+            Stage("embed", embed, workers=int(os.getenv("SCI_EMBED_WORKERS", 1)), fan_out=True,
+                  flush=flush_embed),
+            Stage("index", index, workers=1),
+        ], queue_size=int(os.getenv("SCI_PIPELINE_QUEUE_SIZE", 16)))
+        jobs = list(enumerate(pubmed_urls))
+        try:
+            pipeline.run(jobs[start:start + EFETCH_BATCH_SIZE] for start in range(0, len(jobs), EFETCH_BATCH_SIZE))
+        finally:
+            # 异常时也写入已缓冲的 chunk 并保存 BM25 索引
+            writer.close()
         print("已构建向量数据库")
 
+        paper_content = [downloaded[i] for i in sorted(downloaded)]
+        self._save_paper_content(paper_content)
+
         state["paper_content"] = paper_content
         state["chroma_dir"] = self.persist_directory
         print("已更新state")
@@ -0,0 +1,148 @@
+# sciengine/tools/score_cache.py
+"""
+BGE 精排分数缓存。
+question agent 生成的问题在不同章节、不同次运行之间经常重复或几乎一样，
+精排分数按 (归一化 query, chunk 内容哈希) 缓存，命中时跳过 reranker 前向传播。
+- 内存 LRU，条目数有上限
+- 可选持久化到磁盘（jsonl，每行 [key, score]），进程重启后继续命中；
+  flush 只追加新分数，文件行数超过条目数的 2 倍时才整体重写（压缩）
+- 暴露 hits / misses 计数供监控
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """小写 + 合并空白 + 去掉首尾标点，吸收问题之间的细微差别"""
+    text = re.sub(r"\s+", " ", query.strip().lower())
+    return text.strip(" ?？.。!！")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class RerankScoreCache:
+    def __init__(self, max_entries: int = 100_000, persist_path: Optional[str] = None):
+        self.max_entries = max(1, int(max_entries))
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self._scores: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, float]] = []  # 尚未追加到磁盘的新分数
+        self._file_lines = 0
+        self._needs_compact = False
+        if persist_path:
+            self._load()
+
+    @staticmethod
+    def make_key(query: str, passage: str) -> str:
+        return f"{content_hash(normalize_query(query))}:{content_hash(passage)}"
+
+    def get_many(self, pairs: Sequence[Tuple[str, str]]) -> List[Optional[float]]:
+        """命中返回分数，未命中返回 None，顺序与输入一致"""
+        results: List[Optional[float]] = []
+        with self._lock:
+            for query, passage in pairs:
+                key = self.make_key(query, passage)
+                score = self._scores.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._scores.move_to_end(key)
+                results.append(score)
+        return results
+
+    def put_many(self, pairs: Sequence[Tuple[str, str]], scores: Sequence[float]):
+        with self._lock:
+            for (query, passage), score in zip(pairs, scores):
+                key = self.make_key(query, passage)
+                self._scores[key] = float(score)
+                self._scores.move_to_end(key)
+                if self.persist_path:
+                    self._pending.append((key, float(score)))
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._scores),
+            }
+
+    def flush(self):
+        """新分数追加到磁盘；文件中过期 / 被淘汰的行过多时整体重写（先写临时文件再原子替换）"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._pending and not self._needs_compact:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+            if self._needs_compact or self._file_lines + len(self._pending) > 2 * max(len(self._scores), 1):
+                tmp_path = self.persist_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for key, score in self._scores.items():
+                        f.write(json.dumps([key, score]) + "\n")
+                os.replace(tmp_path, self.persist_path)
+                self._file_lines = len(self._scores)
+                self._needs_compact = False
+            else:
+                with open(self.persist_path, "a", encoding="utf-8") as f:
+                    for key, score in self._pending:
+                        f.write(json.dumps([key, score]) + "\n")
+                self._file_lines += len(self._pending)
+            self._pending = []
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 上次写到一半的行：跳过，下次 flush 时重写
+                        self._needs_compact = True
+                        continue
+                    self._file_lines += 1
+                    key, score = record
+                    self._scores[key] = float(score)
+                    self._scores.move_to_end(key)
+                    if len(self._scores) > self.max_entries:
+                        self._scores.popitem(last=False)
+            print(f"[RerankCache] 已加载 {len(self._scores)} 条精排分数: {self.persist_path}")
+        except Exception as e:
+            print(f"[RerankCache] 缓存文件损坏，忽略: {e}")
+            self._scores.clear()
+            self._needs_compact = True
+
+
+def score_with_cache(reranker, cache: Optional[RerankScoreCache],
+                     pairs: List[Tuple[str, str]]) -> List[float]:
+    """
+    先查缓存，只把未命中的句对送入 reranker，新分数写回缓存
+    """
+    if cache is None:
+        return reranker.compute_score(pairs)
+
+    scores = cache.get_many(pairs)
+    missing = [i for i, s in enumerate(scores) if s is None]
+    if missing:
+        computed = reranker.compute_score([pairs[i] for i in missing])
+        for i, score in zip(missing, computed):
+            scores[i] = score
+        cache.put_many([pairs[i] for i in missing], computed)
+        cache.flush()
+    return scores
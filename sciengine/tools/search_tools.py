@@ -3,11 +3,11 @@
 search_agent的tools
 """
 from typing import List, Dict, Any
-import requests
 import xmltodict
 from langchain_core.tools import tool
 import os
 from sciengine.agent.utils import debug_log
+from sciengine.tools.http_client import http_get
 
 
 # --- Search Agent Tools ---
@@ -29,7 +29,7 @@ def search_pubmed(query: str, retmax: int = 50) -> List[str]:
         "api_key": os.environ.get("NCBI_API_KEY")
     }
     try:
-        response = requests.get(base_url, params=params)
+        response = http_get(base_url, params=params)
         debug_log(f"PubMed API response status: {response.status_code}")
         if response.status_code == 200:
             data = xmltodict.parse(response.text)
@@ -67,7 +67,7 @@ def fetch_pubmed_details(pmids: List[str]) -> List[Dict[str, Any]]:
         "api_key": os.environ.get("NCBI_API_KEY")
     }
     try:
-        response = requests.get(base_url, params=params)
+        response = http_get(base_url, params=params)
         debug_log(f"PubMed fetch response status: {response.status_code}")
         if response.status_code == 200:
             data = xmltodict.parse(response.text)
@@ -140,7 +140,7 @@ def search_geo(query: str, retmax: int = 20) -> List[str]:
         "sort": "relevance",
         "api_key": os.environ.get("NCBI_API_KEY")
     }
-    response = requests.get(base_url, params=params)
+    response = http_get(base_url, params=params)
     if response.status_code == 200:
         try:
             data = xmltodict.parse(response.text)
@@ -171,7 +171,7 @@ def fetch_geo_details(gse_ids: List[str]) -> List[Dict[str, Any]]:
         "retmode": "xml",
         "api_key": os.environ.get("NCBI_API_KEY")
     }
-    response = requests.get(base_url, params=params)
+    response = http_get(base_url, params=params)
     if response.status_code == 200:
         try:
             data = xmltodict.parse(response.text)
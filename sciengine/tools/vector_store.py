@@ -0,0 +1,452 @@
+# sciengine/tools/vector_store.py
+"""
+可插拔向量库后端。Pubmed_RAG（写）与 writing_tools（读）都只通过 VectorStore 接口访问向量库：
+    add / delete / get_all / get_documents / snapshot / query / count / metadata_values /
+    fingerprint / persist
+后端：
+    - chroma: 原有的 Chroma 持久化库（默认）
+    - ivfpq:  近似最近邻索引（见 ann_index.py），面向跨请求共享的大规模持久化语料
+    - flat:   进程内扁平索引。单次请求的语料只有几千个 768 维向量，Chroma 的持久化与 SQLite
+              开销反而占大头；这里把归一化向量放在一块连续的 float32/float16 NumPy 矩阵里，
+              metadata 放在平行数组中，top-k = 一次矩阵乘 + argpartition，用 np.save / mmap 持久化
+后端选择：显式参数 > 环境变量 SCI_VECTOR_BACKEND > 目录中已有的后端 > chroma
+"""
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+FLAT_DIRNAME = "flat"
+DEFAULT_BACKEND = "chroma"
+
+
+class VectorStore(ABC):
+    """向量库统一接口；后端必须实现 add / get_all / query / count / fingerprint，其余方法有默认实现"""
+    backend = ""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @abstractmethod
+    def add(self, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[Dict[str, Any]],
+            embeddings: Sequence[Sequence[float]]):
+        """写入 chunk（id 已存在时覆盖）"""
+
+    @abstractmethod
+    def delete(self, where: Dict[str, Any]) -> List[str]:
+        """删除 metadata 与 where（{字段: 值}）全部相等的 chunk，返回被删除的 chunk id"""
+
+    @abstractmethod
+    def get_all(self) -> Dict[str, Any]:
+        """导出全部 chunk: {"ids", "documents", "metadatas", "embeddings": np.ndarray (n, d)}"""
+
+    def get_documents(self) -> Dict[str, Any]:
+        """导出全部 chunk 的 {"ids", "documents", "metadatas"}，不读取向量"""
+        corpus = self.get_all()
+        return {"ids": corpus["ids"], "documents": corpus["documents"], "metadatas": corpus["metadatas"]}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        一次一致的读取：{"ids", "documents", "metadatas", "embeddings"}，embeddings 与 ids 逐行对齐，
+        支持 embeddings[rows] 取部分行；本地后端为 mmap 视图，Chroma 按 chunk id 按需读取，
+        都不把全部向量读进内存
+        """
+        return self.get_all()
+
+    @abstractmethod
+    def query(self, query_embeddings: Sequence[Sequence[float]], k: int) -> List[List[str]]:
+        """批量稠密检索，返回每个 query 的 top-k chunk id（相似度降序）"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """chunk 总数"""
+
+    def metadata_values(self, key: str, where: Optional[Dict[str, Any]] = None) -> set:
+        """
+        某个 metadata 字段在库中出现过的全部取值（如已入库的 pmcid）；
+        where 为 {字段: 值}，只统计这些字段全部相等的 chunk
+        """
+        return _metadata_values(self.get_documents()["metadatas"], key, where)
+
+    @abstractmethod
+    def fingerprint(self) -> tuple:
+        """语料版本指纹，集合有写入即变化"""
+
+    def persist(self):
+        """把尚未落盘的写入刷到磁盘"""
+
+    def build_index(self):
+        """写入完成后构建 / 训练索引（需要训练的后端才实现）"""
+
+    def is_stale(self) -> bool:
+        """磁盘上的库被删除重建时返回 True，需要重新打开"""
+        return False
+
+
+def _metadata_values(metadatas: Sequence[Dict[str, Any]], key: str,
+                     where: Optional[Dict[str, Any]] = None) -> set:
+    return {
+        m.get(key) for m in metadatas
+        if m and m.get(key) is not None and _matches(m, where)
+    }
+
+
+def _matches(meta: Optional[Dict[str, Any]], where: Optional[Dict[str, Any]]) -> bool:
+    return all((meta or {}).get(k) == v for k, v in (where or {}).items())
+
+
+def _chroma_where(where: Dict[str, Any]) -> Dict[str, Any]:
+    return where if len(where) == 1 else {"$and": [{k: v} for k, v in where.items()]}
+
+
+class _ChromaEmbeddingView:
+    """
+    Chroma 向量的按需视图：view[rows] 按这些行的 chunk id 一次性取向量，行号与快照中的 ids 对齐；
+    快照之后被删除的 chunk 返回零向量（语料指纹随之变化，下次会重建快照）
+    """
+
+    def __init__(self, collection, ids: List[str]):
+        self.collection = collection
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, rows):
+        single = np.isscalar(rows)
+        wanted = [self.ids[r] for r in np.atleast_1d(rows).tolist()]
+        result = self.collection.get(ids=list(dict.fromkeys(wanted)), include=["embeddings"])
+        found = dict(zip(result.get("ids", []), result.get("embeddings", [])))
+        dim = len(next(iter(found.values()))) if found else 0
+        out = np.asarray([found.get(cid, np.zeros(dim)) for cid in wanted], dtype=np.float32).reshape(-1, dim)
+        return out[0] if single else out
+
+
+# =====================================================================
+# Chroma 后端
+# =====================================================================
+class ChromaStore(VectorStore):
+    backend = "chroma"
+
+    def __init__(self, path: str, embedding=None):
+        super().__init__(path)
+        from langchain_community.vectorstores import Chroma  # 延迟导入
+        os.makedirs(path, exist_ok=True)
+        self.vectorstore = Chroma(persist_directory=path, embedding_function=embedding)
+        self._collection = self.vectorstore._collection
+        self._inode = self._sqlite_inode()
+
+    def _sqlite_inode(self):
+        sqlite_path = os.path.join(self.path, "chroma.sqlite3")
+        return os.stat(sqlite_path).st_ino if os.path.exists(sqlite_path) else None
+
+    def add(self, ids, texts, metadatas, embeddings):
+        if not ids:
+            return
+        self._collection.upsert(
+            ids=list(ids),
+            documents=list(texts),
+            metadatas=list(metadatas),
+            embeddings=[list(map(float, v)) for v in embeddings],
+        )
+
+    def delete(self, where):
+        ids = list(self._collection.get(where=_chroma_where(where), include=[]).get("ids", []))
+        if ids:
+            self._collection.delete(ids=ids)
+        return ids
+
+    def get_all(self):
+        result = self._collection.get(include=["documents", "metadatas", "embeddings"])
+        return {
+            "ids": list(result.get("ids", [])),
+            "documents": list(result.get("documents", [])),
+            "metadatas": [m or {} for m in result.get("metadatas", [])],
+            "embeddings": np.asarray(result.get("embeddings"), dtype=np.float32),
+        }
+
+    def get_documents(self):
+        result = self._collection.get(include=["documents", "metadatas"])
+        return {
+            "ids": list(result.get("ids", [])),
+            "documents": list(result.get("documents", [])),
+            "metadatas": [m or {} for m in result.get("metadatas", [])],
+        }
+
+    def snapshot(self):
+        # 向量按 id 取，与同一次读取的 ids 对齐，不受之后写入影响
+        corpus = self.get_documents()
+        corpus["embeddings"] = _ChromaEmbeddingView(self._collection, corpus["ids"])
+        return corpus
+
+    def query(self, query_embeddings, k):
+        n = self.count()
+        if n == 0:
+            return [[] for _ in query_embeddings]
+        result = self._collection.query(
+            query_embeddings=[list(map(float, v)) for v in query_embeddings],
+            n_results=min(k, n),
+            include=["distances"],
+        )
+        return [list(ids) for ids in result["ids"]]
+
+    def count(self):
+        return self._collection.count()
+
+    def metadata_values(self, key, where=None):
+        if where:
+            result = self._collection.get(where=_chroma_where(where), include=["metadatas"])
+        else:
+            result = self._collection.get(include=["metadatas"])
+        return {m.get(key) for m in result.get("metadatas") or [] if m and m.get(key) is not None}
+
+    def fingerprint(self):
+        """chunk 数 + sqlite 文件（及 WAL）的 inode / 修改时间 / 大小"""
+        parts = [self.count()]
+        for name in ("chroma.sqlite3", "chroma.sqlite3-wal"):
+            path = os.path.join(self.path, name)
+            if os.path.exists(path):
+                st = os.stat(path)
+                parts.extend([st.st_ino, st.st_mtime_ns, st.st_size])
+        return tuple(parts)
+
+    def is_stale(self):
+        return self._sqlite_inode() != self._inode
+
+
+# =====================================================================
+# 扁平索引后端
+# =====================================================================
+class FlatVectorStore(VectorStore):
+    """
+    磁盘布局（<path>/flat/）：
+        vectors.npy    # (n, d) 归一化向量，float32 或 float16，读取时 mmap
+        records.json   # {"ids": [...], "documents": [...], "metadatas": [...]}，与向量行一一对应
+        meta.json      # {"dim", "dtype", "count", "version"}，最后写入，作为保存完成标记
+    """
+    backend = "flat"
+
+    def __init__(self, path: str, embedding=None, dtype: str = "float32"):
+        super().__init__(path)
+        self.root = os.path.join(path, FLAT_DIRNAME)
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.RLock()
+        self.version = 0
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.matrix = np.zeros((0, 0), dtype=self.dtype)
+        self._row_of: Dict[str, int] = {}
+        self._pending: List[np.ndarray] = []  # 尚未并入 matrix 的新增向量
+        self._dirty = False
+        self._load()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, FLAT_DIRNAME, "meta.json"))
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _load(self):
+        if not self.exists(self.path):
+            return
+        with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(self._file("records.json"), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.version = meta.get("version", 0)
+        self.dtype = np.dtype(meta.get("dtype", self.dtype.name))
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self.matrix = np.load(self._file("vectors.npy"), mmap_mode="r")
+        self._row_of = {cid: row for row, cid in enumerate(self.ids)}
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        new_rows = np.concatenate(self._pending).astype(self.dtype)
+        self.matrix = new_rows if len(self.matrix) == 0 else np.concatenate([np.asarray(self.matrix), new_rows])
+        self._pending = []
+
+    def add(self, ids, texts, metadatas, embeddings):
+        if not ids:
+            return
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            fresh = []
+            copied = False
+            for cid, text, meta, vec in zip(ids, texts, metadatas, vecs):
+                row = self._row_of.get(cid)
+                if row is None:
+                    self._row_of[cid] = len(self.ids)
+                    self.ids.append(cid)
+                    self.documents.append(text)
+                    self.metadatas.append(dict(meta or {}))
+                    fresh.append(vec)
+                    continue
+
+                # id 已存在 → 覆盖该行
+                if row >= len(self.matrix):
+                    # 该行还在 pending 中，先并入矩阵
+                    if fresh:
+                        self._pending.append(np.stack(fresh))
+                        fresh = []
+                    self._merge_pending()
+                if not copied:
+                    # mmap 只读 / 矩阵可能已被 snapshot 返回：先复制再改写
+                    self.matrix = np.array(self.matrix)
+                    copied = True
+                self.matrix[row] = vec
+                self.documents[row] = text
+                self.metadatas[row] = dict(meta or {})
+            if fresh:
+                self._pending.append(np.stack(fresh))
+            self.version += 1
+            self._dirty = True
+
+    def delete(self, where):
+        with self._lock:
+            self._merge_pending()
+            keep = [row for row, meta in enumerate(self.metadatas) if not _matches(meta, where)]
+            if len(keep) == len(self.ids):
+                return []
+            removed = [cid for cid, meta in zip(self.ids, self.metadatas) if _matches(meta, where)]
+            # 按行重建（新数组），已返回的 snapshot 不受影响
+            self.matrix = np.asarray(self.matrix)[keep]
+            self.ids = [self.ids[row] for row in keep]
+            self.documents = [self.documents[row] for row in keep]
+            self.metadatas = [self.metadatas[row] for row in keep]
+            self._row_of = {cid: row for row, cid in enumerate(self.ids)}
+            self.version += 1
+            self._dirty = True
+            return removed
+
+    def get_all(self):
+        with self._lock:
+            self._merge_pending()
+            return {
+                "ids": list(self.ids),
+                "documents": list(self.documents),
+                "metadatas": list(self.metadatas),
+                "embeddings": np.asarray(self.matrix, dtype=np.float32),
+            }
+
+    def get_documents(self):
+        with self._lock:
+            return {"ids": list(self.ids), "documents": list(self.documents), "metadatas": list(self.metadatas)}
+
+    def snapshot(self):
+        # 覆盖写会先复制矩阵，返回的矩阵之后不再被修改
+        with self._lock:
+            self._merge_pending()
+            corpus = self.get_documents()
+            corpus["embeddings"] = self.matrix
+            return corpus
+
+    def query(self, query_embeddings, k):
+        with self._lock:
+            self._merge_pending()
+            matrix = self.matrix
+            ids = self.ids
+        n = len(ids)
+        k = min(int(k), n)
+        if k <= 0:
+            return [[] for _ in query_embeddings]
+
+        q = np.asarray(query_embeddings, dtype=np.float32)
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        scores = q @ np.asarray(matrix, dtype=np.float32).T  # (Q, n) 余弦相似度
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return [[ids[r] for r in row] for row in top.tolist()]
+
+    def count(self):
+        return len(self.ids)
+
+    def metadata_values(self, key, where=None):
+        with self._lock:
+            return _metadata_values(self.metadatas, key, where)
+
+    def fingerprint(self):
+        return (self.count(), self.version)
+
+    def persist(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._merge_pending()
+            os.makedirs(self.root, exist_ok=True)
+            tmp = self._file("vectors.tmp.npy")
+            np.save(tmp, np.asarray(self.matrix, dtype=self.dtype))
+            os.replace(tmp, self._file("vectors.npy"))
+            tmp = self._file("records.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas},
+                          f, ensure_ascii=False)
+            os.replace(tmp, self._file("records.json"))
+            dim = self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+            tmp = self._file("meta.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"dim": dim, "dtype": self.dtype.name, "count": len(self.ids),
+                           "version": self.version}, f)
+            os.replace(tmp, self._file("meta.json"))
+            # 重新以 mmap 方式挂载，释放内存副本
+            self.matrix = np.load(self._file("vectors.npy"), mmap_mode="r")
+            self._dirty = False
+
+    def is_stale(self):
+        # 只读进程：其他进程重写了索引（version 变化）或目录被删除
+        if self._dirty:
+            return False
+        if not self.exists(self.path):
+            return bool(self.ids)
+        try:
+            with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("version", 0) != self.version
+        except Exception:
+            return True
+
+
+# =====================================================================
+# 工厂
+# =====================================================================
+BACKENDS = {
+    "chroma": ChromaStore,
+    "flat": FlatVectorStore,
+    "ivfpq": None,  # 延迟导入，避免循环依赖
+}
+
+
+def _backend_class(backend: str):
+    if backend == "ivfpq":
+        from sciengine.tools.ann_index import IVFPQVectorStore
+        return IVFPQVectorStore
+    return BACKENDS[backend]
+
+
+def detect_backend(path: str) -> Optional[str]:
+    """根据目录内容判断已有库的后端"""
+    if FlatVectorStore.exists(path):
+        return "flat"
+    if os.path.exists(os.path.join(path, "ivfpq", "meta.json")):
+        return "ivfpq"
+    if os.path.exists(os.path.join(path, "chroma.sqlite3")):
+        return "chroma"
+    return None
+
+
+def open_vector_store(path: str, embedding=None, backend: Optional[str] = None) -> VectorStore:
+    """
+    打开（或新建）向量库；backend 为空时依次参考 SCI_VECTOR_BACKEND、目录中已有的后端、默认 chroma
+    """
+    backend = backend or os.getenv("SCI_VECTOR_BACKEND") or detect_backend(path) or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的向量库后端: {backend}（可选: {', '.join(BACKENDS)}）")
+    return _backend_class(backend)(path, embedding=embedding)
@@ -3,41 +3,85 @@
 writing_node的 retriever tools
 """
 from typing import List, Dict, Any, Optional
+import numpy as np
 from langchain_core.documents import Document
 from rank_bm25 import BM25Okapi
-from sciengine.agent.utils import info, error
-from sciengine.tools.bge_reranker import BgeReranker
+from sciengine.agent.utils import info, error, debug
 import os
-from langchain_community.vectorstores import Chroma
-from sciengine.model.bioembedding_model import BioBERTEmbeddings
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
+import threading
+from sciengine.tools.vector_store import VectorStore, open_vector_store
+from sciengine.model.registry import get_embedding_model, get_reranker_model
+from sciengine.tools.mmr import batch_mmr
+from sciengine.tools.score_cache import RerankScoreCache, score_with_cache
+from sciengine.tools.retrieval_cache import RetrievalCache
+from sciengine.tools.bm25_index import BM25Index
+from sciengine.tools.hybrid_retriever import HybridRetriever
 
 # ==============================
-# 全局 reranker（这个可以保留全局，加载一次）
+# 全局 reranker（由模型注册表保证每个进程只加载一次）
 # ==============================
-_reranker = None
+def get_reranker():
+    try:
+        return get_reranker_model()
+    except Exception as e:
+        error(f"reranker 加载失败: {e}，将跳过精排")
+        return None
 
 
-def get_reranker():
-    global _reranker
-    if _reranker is None:
-        try:
-            _reranker = BgeReranker()
-            info("BGE Reranker 加载成功")
-        except Exception as e:
-            error(f"reranker 加载失败: {e}，将跳过精排")
-            _reranker = None
-    return _reranker
+# 精排分数缓存：设置 RERANK_CACHE_PATH 时持久化到该文件，否则只在内存中
+_score_cache = RerankScoreCache(persist_path=os.getenv("RERANK_CACHE_PATH") or None)
+
+
+def rerank_cache_stats() -> Dict[str, float]:
+    """精排缓存命中统计（hits / misses / hit_rate / size）"""
+    return _score_cache.stats()
+
+
+# 检索结果缓存：只存 chunk id + 精排分数；RETRIEVAL_CACHE_SIZE / RETRIEVAL_CACHE_TTL（秒）可调
+_retrieval_cache = RetrievalCache(
+    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", 3600)),
+)
+
+
+def retrieval_cache_stats() -> Dict[str, float]:
+    """检索结果缓存命中统计（hits / misses / hit_rate / size）"""
+    return _retrieval_cache.stats()
 
 
 # ==============================
-# 核心：根据 state 实时构建检索器（关键函数！）
+# 检索器缓存：按 chroma_dir + 语料指纹复用向量库句柄 / BM25 / 混合检索器
 # ==============================
-def build_retriever_from_state(state: Dict[str, Any], k: int = 20) -> Optional[Any]:
+_vectorstores: Dict[str, VectorStore] = {}        # db_path -> 向量库句柄
+_retriever_cache: Dict[Any, Dict[str, Any]] = {}  # (db_path, k) -> 语料（见 get_corpus_from_state）
+_build_locks: Dict[str, threading.Lock] = {}      # db_path -> 构建锁（同一库的语料 / BM25 同步只由一个线程做）
+_cache_lock = threading.Lock()
+
+
+def _build_lock(db_path: str) -> threading.Lock:
+    with _cache_lock:
+        return _build_locks.setdefault(db_path, threading.Lock())
+
+
+def get_vectorstore(db_path: str) -> VectorStore:
     """
-    每次调用都根据 state 中的最新向量库路径，实时构建混合检索器
+    同一目录只打开一次向量库（后端见 vector_store.open_vector_store）；库被删除重建时重新打开
     """
+    with _cache_lock:
+        cached = _vectorstores.get(db_path)
+    if cached is not None and not cached.is_stale():
+        return cached
+
+    vectorstore = open_vector_store(db_path, embedding=get_embedding_model())
+    with _cache_lock:
+        _vectorstores[db_path] = vectorstore
+    return vectorstore
+
+
+# ==============================
+# 核心：根据 state 构建（或复用）检索器（关键函数！）
+# ==============================
+def _resolve_db_path(state: Dict[str, Any]) -> Optional[str]:
     db_path = state.get("vector_db_path") or state.get("chroma_dir", "").strip()
 
     if not db_path or not os.path.exists(db_path):
@@ -48,43 +92,100 @@ def build_retriever_from_state(state: Dict[str, Any], k: int = 20) -> Optional[A
         debug(f"[Retriever] 路径不是目录: {db_path}")
         return None
 
+    return os.path.abspath(db_path)
+
+
+def _build_corpus(db_path: str, k: int, vectorstore: VectorStore, fingerprint: tuple) -> Optional[Dict[str, Any]]:
+    """从向量库构建语料与混合检索器并写入缓存（调用方持有 db_path 的构建锁）"""
+    info(f"正在从实时向量库构建检索器: {db_path}")
+
+    # 2. 一次读取得到文本（BM25）与逐行对齐的向量视图（本地后端 mmap / Chroma 按 id），MMR 时按候选行读取
+    result = vectorstore.snapshot()
+    ids = result["ids"]
+    documents = result["documents"]
+    metadatas = result["metadatas"]
+
+    if not documents:
+        info("[Retriever] 向量库为空")
+        # 空库不缓存，下次调用重新检查
+        return None
+
+    id_to_row = {cid: row for row, cid in enumerate(ids)}
+
+    # 3. 加载持久化 BM25 索引（mmap 懒加载），与向量库不一致时增量补齐后写回
+    bm25_index = BM25Index.for_chroma_dir(db_path)
+    if bm25_index.sync(ids, documents):
+        bm25_index.save()
+        info(f"[Retriever] BM25 索引已与向量库同步: {bm25_index.path}")
+
+    # 4. 混合检索（稠密 / BM25 并发召回，行号上加权 RRF，默认权重 0.7 / 0.3）
+    hybrid_retriever = HybridRetriever(
+        store=vectorstore,
+        bm25_index=bm25_index,
+        embedding=get_embedding_model(),
+        ids=ids,
+        documents=documents,
+        metadatas=metadatas,
+        id_to_row=id_to_row,
+        k=k
+    )
+
+    corpus = {
+        "db_path": db_path,
+        "fingerprint": fingerprint,
+        "vectorstore": vectorstore,
+        "ids": ids,
+        "documents": documents,
+        "metadatas": metadatas,
+        "embeddings": result["embeddings"],
+        "id_to_row": id_to_row,
+        "k": k,
+        "bm25_index": bm25_index,
+        "retriever": hybrid_retriever,
+    }
+    with _cache_lock:
+        _retriever_cache[(db_path, k)] = corpus
+
+    info(f"[Retriever] 混合检索器构建完成，共 {len(documents)} 篇候选文档")
+    return corpus
+
+
+def get_corpus_from_state(state: Dict[str, Any], k: int = 20) -> Optional[Dict[str, Any]]:
+    """
+    根据 state 中的最新向量库路径获取检索语料（含混合检索器）；
+    同一 chroma_dir 且语料未变化时直接复用缓存，集合有写入时自动重建。
+    返回:
+        {
+            "db_path", "fingerprint", "vectorstore",
+            "ids", "documents", "metadatas",   # 与向量库中 chunk 一一对应
+            "embeddings": 与 ids 逐行对齐的 (n, d) 向量视图，供 MMR 按候选行取用
+            "id_to_row": {chunk_id: 行号},
+            "bm25_index", "retriever": HybridRetriever
+        }
+    """
+    db_path = _resolve_db_path(state)
+    if not db_path:
+        return None
+
     try:
-        info(f"正在从实时向量库加载检索器: {db_path}")
-
-        # 1. 加载 Chroma 向量库（只加载一次，后面复用）
-        vectorstore = Chroma(
-            persist_directory=db_path,
-            embedding_function=BioBERTEmbeddings()
-        )
-
-        # 2. 获取所有文档文本，用于 BM25
-        result = vectorstore.get(include=["documents", "metadatas"])
-        documents = result.get("documents", [])
-        metadatas = result.get("metadatas", [])
-
-        if not documents:
-            info("[Retriever] 向量库为空")
-            return vectorstore.as_retriever(search_kwargs={"k": k})
-
-        # 3. 构建 BM25 检索器
-        bm25_retriever = BM25Retriever.from_texts(
-            texts=documents,
-            metadatas=metadatas,
-            k=k
-        )
-        bm25_retriever.k = k
-
-        # 4. 构建 Chroma 检索器
-        chroma_retriever = vectorstore.as_retriever(search_kwargs={"k": k})
-
-        # 5. 混合检索（推荐权重）
-        ensemble_retriever = EnsembleRetriever(
-            retrievers=[chroma_retriever, bm25_retriever],
-            weights=[0.7, 0.3]  # 语义 > 关键词
-        )
-
-        info(f"[Retriever] 混合检索器构建完成，共 {len(documents)} 篇候选文档")
-        return ensemble_retriever
+        # 1. 加载向量库（只加载一次，后面复用）
+        vectorstore = get_vectorstore(db_path)
+
+        cache_key = (db_path, k)
+        fingerprint = (vectorstore.backend,) + vectorstore.fingerprint()
+        with _cache_lock:
+            cached = _retriever_cache.get(cache_key)
+        if cached and cached["fingerprint"] == fingerprint:
+            return cached
+
+        # writing_node 并发写多个章节时，冷启动 / 语料变化后只由一个线程重建，其余线程等待后复用
+        with _build_lock(db_path):
+            fingerprint = (vectorstore.backend,) + vectorstore.fingerprint()
+            with _cache_lock:
+                cached = _retriever_cache.get(cache_key)
+            if cached and cached["fingerprint"] == fingerprint:
+                return cached
+            return _build_corpus(db_path, k, vectorstore, fingerprint)
 
     except Exception as e:
         error(f"[Retriever] 构建失败: {e}")
@@ -93,52 +194,161 @@ def build_retriever_from_state(state: Dict[str, Any], k: int = 20) -> Optional[A
         return None
 
 
+def build_retriever_from_state(state: Dict[str, Any], k: int = 20) -> Optional[Any]:
+    """
+    兼容旧接口：返回缓存中的混合检索器（LangChain BaseRetriever）
+    """
+    corpus = get_corpus_from_state(state, k=k)
+    return corpus["retriever"] if corpus else None
+
+
+def _row_to_doc(corpus: Dict[str, Any], row: int) -> Document:
+    """按行号新建 Document（不复用缓存中的对象，避免写 metadata 时污染缓存）"""
+    return corpus["retriever"].row_to_doc(row)
+
+
+def hybrid_recall_many(query_vecs: List[List[float]], queries: List[str],
+                       corpus: Dict[str, Any]) -> List[List[int]]:
+    """
+    一批 query 的混合召回：稠密召回一次批量查询向量库（复用已算好的查询向量），
+    BM25 一次稀疏矩阵乘法打分，两路并发，在行号上加权 RRF 融合，返回候选行号
+    """
+    return corpus["retriever"].recall_rows_many(query_vecs, queries)
+
+
 # ==============================
 # 最强检索入口（对外接口）
 # ==============================
-def strongest_retrieve(query: str, state: Dict[str, Any]) -> List[Document]:
+def strongest_retrieve(query: str, state: Dict[str, Any], fetch_k: int = 30,
+                       mmr_k: int = 15, mmr_lambda: float = 0.5, top_n: int = 10) -> List[Document]:
     """
     最终对外调用的检索函数，必须传入 state！
+    查询只编码一次：稠密召回、MMR 复用同一个查询向量；MMR 在已召回的候选上进行，不再回查向量库
+    fetch_k: 稠密 / BM25 各自召回的候选数
+    mmr_k / mmr_lambda: MMR 保留（即送入精排）的候选数与多样性系数（1 → 只看相关度）
+    精排按微批进行，mmr_k 调到 100+ 时内存也不会随之增长
     """
-    retriever = build_retriever_from_state(state, k=30)
+    return strongest_retrieve_many([query], state, fetch_k=fetch_k, mmr_k=mmr_k,
+                                   mmr_lambda=mmr_lambda, top_n=top_n)[0]
 
-    if not retriever:
-        info("[strongest_retrieve] 无可用检索器，返回空结果")
+
+def strongest_retrieve_many(queries: List[str], state: Dict[str, Any], fetch_k: int = 30,
+                            mmr_k: int = 15, mmr_lambda: float = 0.5,
+                            top_n: int = 10) -> List[List[Document]]:
+    """
+    章节级多 query 检索：一个章节的全部问题一起处理，返回与 queries 一一对应的文档列表
+    - 先查检索结果缓存（归一化 query + 语料指纹 + 参数），命中的问题不再检索
+    - 未命中的问题一次批量编码，MMR 一次批量完成
+    - 收集全部 (问题, passage) 句对，重复的问题 / 同一问题下重复的 passage 只打一次分
+    - 所有句对一次送入 reranker（内部按微批打分），再按问题拆回
+    """
+    if not queries:
         return []
 
+    corpus = get_corpus_from_state(state, k=fetch_k)
+
+    if not corpus:
+        info("[strongest_retrieve] 无可用检索器，返回空结果")
+        return [[] for _ in queries]
+
     try:
-        # 第一步：混合检索召回
-        candidate_docs = retriever.invoke(query)
-        info(f"[strongest_retrieve] 混合检索召回 {len(candidate_docs)} 篇")
-
-        # 第二步：MMR 多样性排序（可选）
-        db_path = state.get("vector_db_path") or state.get("chroma_dir", "").strip()
-        vectorstore = Chroma(
-            persist_directory=db_path,
-            embedding_function=BioBERTEmbeddings()
-        )
-
-        mmr_docs = vectorstore.max_marginal_relevance_search(query, k=15, fetch_k=30)
-
-        # 第三步：BGE Reranker 精排（最强）
-        reranker = get_reranker()
-        if reranker and mmr_docs:
-            pairs = [(query, doc.page_content) for doc in mmr_docs]
-            scores = reranker.compute_score(pairs)
-            # 合并分数
-            for doc, score in zip(mmr_docs, scores):
-                doc.metadata["rerank_score"] = score
-            # 按精排分数排序
-            ranked = sorted(mmr_docs, key=lambda x: x.metadata.get("rerank_score", 0), reverse=True)
-            final_docs = ranked[:10]
+        # 重复的问题只检索一次
+        unique_queries = list(dict.fromkeys(q.strip() for q in queries))
+
+        scope = (corpus["db_path"], corpus["fingerprint"])
+        params = (fetch_k, mmr_k, mmr_lambda, top_n)
+        cache_keys = {q: RetrievalCache.make_key(scope, q, params) for q in unique_queries}
+        results_by_query: Dict[str, List[Document]] = {}
+        for q in unique_queries:
+            cached = _retrieval_cache.get(cache_keys[q])
+            if cached is not None:
+                results_by_query[q] = _hits_to_docs(corpus, cached)
+
+        pending = [q for q in unique_queries if q not in results_by_query]
+        if pending:
+            results_by_query.update(_retrieve_uncached(pending, corpus, mmr_k, mmr_lambda, top_n, cache_keys))
         else:
-            final_docs = mmr_docs[:10] if mmr_docs else candidate_docs[:10]
+            info(f"[strongest_retrieve] {len(unique_queries)} 个问题全部命中检索缓存")
 
-        info(f"[strongest_retrieve] 最终返回 {len(final_docs)} 篇精选文献")
-        return final_docs
+        # 拆回原始问题顺序（重复问题各自拿一份拷贝）
+        return [[Document(id=d.id, page_content=d.page_content, metadata=dict(d.metadata))
+                 for d in results_by_query[q.strip()]] for q in queries]
 
     except Exception as e:
         error(f"strongest_retrieve 异常: {e}")
         import traceback
         traceback.print_exc()
-        return []
+        return [[] for _ in queries]
+
+
+def _hits_to_docs(corpus: Dict[str, Any], hits) -> List[Document]:
+    """缓存中的 (chunk_id, 精排分数) 还原成 Document"""
+    docs = []
+    for cid, score in hits:
+        row = corpus["id_to_row"].get(cid)
+        if row is None:
+            continue
+        doc = _row_to_doc(corpus, row)
+        if score is not None:
+            doc.metadata["rerank_score"] = score
+        docs.append(doc)
+    return docs
+
+
+def _retrieve_uncached(unique_queries: List[str], corpus: Dict[str, Any], mmr_k: int,
+                       mmr_lambda: float, top_n: int, cache_keys: Dict[str, Any]) -> Dict[str, List[Document]]:
+    """混合召回 → MMR → 精排，结果写回检索缓存"""
+    query_vecs = get_embedding_model().embed_queries(unique_queries)
+
+    # 第一步：混合检索召回
+    candidate_rows = hybrid_recall_many(query_vecs, unique_queries, corpus)
+    info(f"[strongest_retrieve] {len(unique_queries)} 个问题混合检索召回 "
+         f"{sum(len(rows) for rows in candidate_rows)} 篇")
+
+    # 第二步：MMR 多样性排序（在召回候选上批量进行）
+    picked = batch_mmr(
+        np.asarray(query_vecs, dtype=np.float32),
+        [np.asarray(corpus["embeddings"][rows], dtype=np.float32) for rows in candidate_rows],
+        k=mmr_k,
+        lambda_mult=mmr_lambda,
+    )
+    mmr_rows = [[rows[i] for i in idx] for rows, idx in zip(candidate_rows, picked)]
+
+    # 同一问题下文本相同的 passage 只保留一条
+    for i, rows in enumerate(mmr_rows):
+        seen = set()
+        mmr_rows[i] = [r for r in rows
+                       if corpus["documents"][r] not in seen and not seen.add(corpus["documents"][r])]
+
+    # 第三步：BGE Reranker 精排（所有问题的句对一次打分）
+    reranker = get_reranker()
+    scores_by_query: List[Optional[List[float]]] = [None] * len(unique_queries)
+    pairs = [(q, corpus["documents"][r]) for q, rows in zip(unique_queries, mmr_rows) for r in rows]
+    if reranker and pairs:
+        flat_scores = score_with_cache(reranker, _score_cache, pairs)
+        offset = 0
+        for i, rows in enumerate(mmr_rows):
+            scores_by_query[i] = flat_scores[offset:offset + len(rows)]
+            offset += len(rows)
+
+    results_by_query = {}
+    for i, q in enumerate(unique_queries):
+        docs = [_row_to_doc(corpus, row) for row in mmr_rows[i]]
+        if scores_by_query[i] is not None and docs:
+            # 合并分数
+            for doc, score in zip(docs, scores_by_query[i]):
+                doc.metadata["rerank_score"] = score
+            # 按精排分数排序
+            docs = sorted(docs, key=lambda x: x.metadata.get("rerank_score", 0), reverse=True)
+        elif not docs:
+            docs = [_row_to_doc(corpus, r) for r in candidate_rows[i][:top_n]]
+        results_by_query[q] = docs[:top_n]
+        # reranker 不可用时是降级结果，不写缓存
+        if reranker:
+            _retrieval_cache.put(cache_keys[q],
+                                 [(d.id, d.metadata.get("rerank_score")) for d in results_by_query[q]])
+
+    stats = _score_cache.stats()
+    info(f"[strongest_retrieve] {len(unique_queries)} 个问题精排 {len(pairs)} 个句对，"
+         f"每题最多返回 {top_n} 篇精选文献（精排缓存命中 {stats['hits']}/{stats['hits'] + stats['misses']}）")
+    return results_by_query
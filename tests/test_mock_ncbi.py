@@ -0,0 +1,178 @@
+# tests/test_mock_ncbi.py
+"""
+用本地 MockNCBIServer 测试 NCBI 网络层（不访问外网）：
+- ID 转换批量请求（每次最多 200 个 PMID）、不在 PMC 中 / 无效 PMID、批量失败时抓取 PubMed 页面兜底
+- 429 + Retry-After 重试
+- PMC 全文 JATS XML 批量获取，出版方不提供 XML 正文的文章不返回（由调用方走 HTML 兜底）
+- 批量接口按单个 id 缓存：批次组成 / 顺序变化时仍命中，离线回放不访问网络
+"""
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from sciengine.tools import http_cache, http_client
+from sciengine.tools.mock_ncbi import EUTILS_PATH, IDCONV_PATH, MockNCBIServer
+from sciengine.tools.pmc_fulltext import fetch_jats_batch
+from sciengine.tools.pubmed_to_pmc import batch_pmid_to_pmcid, resolve_pubmed_urls
+
+
+@pytest.fixture
+def ncbi(monkeypatch, tmp_path):
+    def start(records, **kwargs):
+        server = MockNCBIServer(records, **kwargs).start()
+        servers.append(server)
+        monkeypatch.setenv("NCBI_IDCONV_URL", server.idconv_url)
+        monkeypatch.setenv("NCBI_EUTILS_URL", server.eutils_url)
+        return server
+
+    servers = []
+    # 每个请求都要到达 mock 服务，便于按请求数断言
+    monkeypatch.setenv("SCI_HTTP_CACHE", "0")
+    monkeypatch.setenv("SCI_RATE_LIMIT_DIR", str(tmp_path))
+    monkeypatch.setattr(http_client, "BACKOFF_BASE", 0.01)
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _requests_to(server, path):
+    return [r for r in server.requests if r.startswith(path)]
+
+
+def test_idconv_batches_200_pmids_per_request(ncbi):
+    records = {str(pmid): f"PMC{pmid}" for pmid in range(1000, 1250)}
+    server = ncbi(records)
+    urls = [server.pubmed_url(pmid) for pmid in records]
+
+    resolved = resolve_pubmed_urls(urls)
+
+    assert len(_requests_to(server, IDCONV_PATH)) == 2
+    assert len(server.requests) == 2  # 没有逐篇抓取页面
+    assert resolved[server.pubmed_url("1000")]["pmc_url"] == "https://pmc.ncbi.nlm.nih.gov/articles/PMC1000/"
+    assert all(res and res["pmcid"] for res in resolved.values())
+
+
+def test_not_in_pmc_and_invalid_pmid_do_not_fall_back(ncbi):
+    server = ncbi({"1": "PMC11", "2": None})
+    urls = [server.pubmed_url(pmid) for pmid in ("1", "2", "3")]  # 3 不在 records 中：无效 PMID
+
+    resolved = resolve_pubmed_urls(urls, titles={urls[0]: "Paper 1"})
+
+    assert len(server.requests) == 1
+    assert resolved[urls[0]]["pmcid"] == "PMC11"
+    assert resolved[urls[0]]["title"] == "Paper 1"
+    assert resolved[urls[0]]["doi"] == "10.0000/1"
+    for url in urls[1:]:
+        assert resolved[url]["pmc_url"] is None
+        assert resolved[url]["pmcid"] is None
+
+
+def test_batch_failure_falls_back_to_pubmed_pages(ncbi):
+    server = ncbi({"1": "PMC11", "2": None})
+    urls = [server.pubmed_url("1"), server.pubmed_url("2")]
+    server.fail_next(1, status=400)  # 4xx 不重试，批量解析失败
+
+    resolved = resolve_pubmed_urls(urls)
+
+    assert len(_requests_to(server, IDCONV_PATH)) == 1
+    assert sorted(server.requests[1:]) == ["/1/", "/2/"]
+    assert resolved[urls[0]]["pmc_url"] == "https://pmc.ncbi.nlm.nih.gov/articles/PMC11/"
+    assert resolved[urls[0]]["title"] == "Article 1"
+    assert resolved[urls[1]]["pmc_url"] is None
+
+
+def test_url_without_pmid_is_resolved_from_page(ncbi):
+    server = ncbi({"1": "PMC11"})
+    url = server.pubmed_url("1") + "?from=search"
+    bad = server.url + "/not-a-pmid/"
+
+    resolved = resolve_pubmed_urls([url, bad])
+
+    assert resolved[url]["pmcid"] == "PMC11"
+    assert "/not-a-pmid/" in server.requests  # 取不到 PMID 的逐篇抓取（404 → 无法解析）
+    assert resolved[bad] is None
+
+
+def test_429_retry_after_is_honoured(ncbi):
+    server = ncbi({"1": "PMC11"})
+    server.fail_next(2, status=429, retry_after=0.2)
+
+    start = time.perf_counter()
+    mapping = batch_pmid_to_pmcid(["1"])
+    elapsed = time.perf_counter() - start
+
+    assert mapping == {"1": {"pmcid": "PMC11", "doi": "10.0000/1"}}
+    assert len(_requests_to(server, IDCONV_PATH)) == 3
+    assert elapsed >= 0.4
+
+
+def test_fetch_jats_batch_skips_withheld_articles(ncbi):
+    server = ncbi({"1": "PMC11", "2": "PMC22", "3": "PMC33"}, xml_withheld=["PMC22"])
+
+    articles = fetch_jats_batch(["PMC11", "https://pmc.ncbi.nlm.nih.gov/articles/PMC22/", "33", "PMC11"])
+
+    assert len(_requests_to(server, EUTILS_PATH + "efetch.fcgi")) == 1
+    assert sorted(articles) == ["PMC11", "PMC33"]
+    sections = articles["PMC11"]["sections"]
+    assert [s["title"] for s in sections] == ["Abstract", "Introduction", "Methods", "Methods > Cell culture"]
+    assert sections[-1]["text"] == "Cells of PMC11."
+    assert articles["PMC33"]["title"] == "Article PMC33"
+
+
+def test_fetch_jats_batch_splits_requests(ncbi):
+    records = {str(i): f"PMC{i}" for i in range(1, 6)}
+    server = ncbi(records)
+
+    articles = fetch_jats_batch(list(records.values()), batch_size=2)
+
+    assert len(_requests_to(server, EUTILS_PATH + "efetch.fcgi")) == 3
+    assert len(articles) == 5
+
+
+def test_fetch_jats_batch_failure_returns_partial_results(ncbi):
+    server = ncbi({"1": "PMC1", "2": "PMC2"})
+    server.fail_next(1, status=404)
+
+    articles = fetch_jats_batch(["PMC1", "PMC2"], batch_size=1)
+
+    assert len(articles) == 1
+    assert len(server.requests) == 2
+
+
+def _ids(request_path):
+    query = parse_qs(urlparse(request_path).query)
+    return (query.get("ids") or query.get("id"))[0]
+
+
+def test_per_id_cache_hits_across_reordered_batches_and_offline(ncbi, monkeypatch, tmp_path):
+    monkeypatch.setenv("SCI_HTTP_CACHE", "1")
+    monkeypatch.setenv("SCI_HTTP_CACHE_DIR", str(tmp_path / "http_cache"))
+    monkeypatch.setattr(http_cache, "_cache", None)
+    server = ncbi({str(i): f"PMC{i}" for i in range(1, 5)}, xml_withheld=["PMC2"])
+
+    batch_pmid_to_pmcid(["3", "1", "2"])
+    fetch_jats_batch(["PMC3", "PMC1", "PMC2"])
+    assert [_ids(r) for r in server.requests] == ["1,2,3", "1,2,3"]  # 批内按 id 排序
+
+    # 顺序不同、部分重叠的批次：只请求新的 id（无正文的 PMC2 也不再请求）
+    batch_pmid_to_pmcid(["2", "4", "1"])
+    articles = fetch_jats_batch(["PMC2", "PMC1", "PMC4"])
+    assert [_ids(r) for r in server.requests[2:]] == ["4", "4"]
+    assert sorted(articles) == ["PMC1", "PMC4"]
+
+    # 离线回放：全部命中，不访问网络
+    monkeypatch.setenv("SCI_HTTP_OFFLINE", "1")
+    monkeypatch.setattr(http_cache, "_cache", None)
+    mapping = batch_pmid_to_pmcid(["4", "3", "2", "1"])
+    articles = fetch_jats_batch(["PMC4", "PMC3", "PMC2", "PMC1"])
+    assert len(server.requests) == 4
+    assert mapping["2"] == {"pmcid": "PMC2", "doi": "10.0000/2"}
+    assert sorted(articles) == ["PMC1", "PMC3", "PMC4"]
+
+
+def test_pmc_efetch_uses_fulltext_ttl():
+    efetch = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+    assert http_cache.ttl_for(efetch + "?db=pmc&id=1") == 90 * http_cache.DAY
+    assert http_cache.ttl_for(efetch + "?db=pubmed&id=1") == 30 * http_cache.DAY
+    assert http_cache.ttl_for("https://pmc.ncbi.nlm.nih.gov/articles/PMC1/") == 90 * http_cache.DAY